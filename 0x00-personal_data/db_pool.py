@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Thin, thread-safe pool of reusable DB-API connections
+"""
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Iterator
+import threading
+import time
+
+
+def is_healthy(cnx) -> bool:
+    """Returns True if the connection still answers
+
+    MySQL connections are asked with `is_connected()` (a ping), other
+    DB-API connections with a `SELECT 1`.
+    """
+    if hasattr(cnx, "is_connected"):
+        try:
+            return cnx.is_connected()
+        except Exception:
+            return False
+    try:
+        cursor = cnx.cursor()
+        cursor.execute("SELECT 1")
+        cursor.fetchall()
+        cursor.close()
+        return True
+    except Exception:
+        return False
+
+
+def reset(cnx) -> bool:
+    """Undoes what a borrower left on the connection; returns False if
+    the connection is unusable
+
+    Unread results, e.g. of an unbuffered cursor, are consumed, then
+    MySQL connections get their session reset (which also rolls back),
+    as mysql.connector.pooling does, and other DB-API connections a
+    rollback.
+    """
+    try:
+        if getattr(cnx, "unread_result", False):
+            cnx.consume_results()
+        if hasattr(cnx, "reset_session"):
+            cnx.reset_session()
+        else:
+            cnx.rollback()
+        return True
+    except Exception:
+        return False
+
+
+def _close_quietly(cnx):
+    """Closes a connection, ignoring errors from a dead one"""
+    try:
+        cnx.close()
+    except Exception:
+        pass
+
+
+class PooledConnection:
+    """Connection proxy that goes back to its pool when closed"""
+
+    def __init__(self, pool: "ConnectionPool", cnx):
+        self._pool = pool
+        self._cnx = cnx
+
+    def __getattr__(self, name: str):
+        if self._cnx is None:
+            raise AttributeError(f"Connection returned to pool: {name}")
+        return getattr(self._cnx, name)
+
+    def __enter__(self) -> "PooledConnection":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Returns the connection to the pool instead of closing it"""
+        if self._cnx is not None:
+            self._pool.release(self._cnx)
+            self._cnx = None
+
+
+class ConnectionPool:
+    """Bounded pool of connections built by `factory`
+
+    At most `size` connections exist at once; `acquire` waits up to
+    `timeout` seconds for one to be released and raises TimeoutError
+    otherwise. Connections idle for at least `check_idle` seconds are
+    health-checked before being handed out and replaced if dead, so
+    connections reused right away cost no round trip. Released
+    connections are reset (see `reset`) and discarded if that fails.
+    """
+
+    def __init__(self, factory: Callable, size: int = 5,
+                 timeout: float = 30.0, check_idle: float = 5.0):
+        if size < 1:
+            raise ValueError("Pool size must be at least 1")
+        self.factory = factory
+        self.size = size
+        self.timeout = timeout
+        self.check_idle = check_idle
+        self._idle = deque()
+        self._opened = 0
+        self._lock = threading.Condition()
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.timeouts = 0
+        self.created = 0
+        self.discarded = 0
+
+    def acquire(self, timeout: float = None) -> PooledConnection:
+        """Checks a connection out of the pool"""
+        if timeout is None:
+            timeout = self.timeout
+        waited_since = None
+        with self._lock:
+            while not self._idle and self._opened >= self.size:
+                now = time.monotonic()
+                if waited_since is None:
+                    waited_since = now
+                    self.waits += 1
+                remaining = timeout - (now - waited_since)
+                if remaining <= 0:
+                    self.timeouts += 1
+                    self.wait_time += now - waited_since
+                    raise TimeoutError("No pooled connection available")
+                self._lock.wait(remaining)
+            if waited_since is not None:
+                self.wait_time += time.monotonic() - waited_since
+            self.checkouts += 1
+            if self._idle:
+                cnx, released_at = self._idle.pop()
+            else:
+                cnx, released_at = None, None
+                self._opened += 1
+
+        if cnx is not None and \
+                time.monotonic() - released_at >= self.check_idle and \
+                not is_healthy(cnx):
+            _close_quietly(cnx)
+            cnx = None
+            with self._lock:
+                self.discarded += 1
+        if cnx is None:
+            try:
+                cnx = self.factory()
+            except Exception:
+                with self._lock:
+                    self._opened -= 1
+                    self._lock.notify()
+                raise
+            with self._lock:
+                self.created += 1
+        return PooledConnection(self, cnx)
+
+    def release(self, cnx):
+        """Resets a checked out connection and puts it back in the pool"""
+        usable = reset(cnx)
+        if not usable:
+            _close_quietly(cnx)
+        with self._lock:
+            if usable:
+                self._idle.append((cnx, time.monotonic()))
+            else:
+                self._opened -= 1
+                self.discarded += 1
+            self._lock.notify()
+
+    @contextmanager
+    def connection(self, timeout: float = None) -> Iterator:
+        """Context manager lending a pooled connection"""
+        cnx = self.acquire(timeout)
+        try:
+            yield cnx
+        finally:
+            cnx.close()
+
+    def stats(self) -> dict:
+        """Returns the pool counters"""
+        with self._lock:
+            return {
+                "size": self.size,
+                "open": self._opened,
+                "idle": len(self._idle),
+                "checkouts": self.checkouts,
+                "waits": self.waits,
+                "wait_time": self.wait_time,
+                "timeouts": self.timeouts,
+                "created": self.created,
+                "discarded": self.discarded,
+            }
+
+    def close(self):
+        """Closes every idle connection"""
+        with self._lock:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._opened -= len(idle)
+        for cnx, _ in idle:
+            _close_quietly(cnx)
@@ -4,9 +4,10 @@
 encrypt_password module
 
 This module provides functions for hashing and validating passwords.
+The bcrypt work runs on the shared pool of hash_executor.
 """
 
-import bcrypt
+from hash_executor import get_executor
 
 
 def hash_password(password: str) -> bytes:
@@ -19,9 +20,7 @@ def hash_password(password: str) -> bytes:
     Returns:
         bytes: The salted, hashed password.
     """
-    salt = bcrypt.gensalt()
-    hashed_password = bcrypt.hashpw(password.encode(), salt)
-    return hashed_password
+    return get_executor().hash_password(password)
 
 
 def is_valid(hashed_password: bytes, password: str) -> bool:
@@ -38,7 +37,39 @@ def is_valid(hashed_password: bytes, password: str) -> bool:
         bool: True if the plain-text password matches the hashed
         password, False otherwise.
     """
-    return bcrypt.checkpw(password.encode(), hashed_password)
+    return get_executor().check_password(password, hashed_password)
+
+
+async def hash_password_async(password: str) -> bytes:
+    """
+    Hashes a password using bcrypt without blocking the event loop.
+
+    Args:
+        password: A string representing the password to be hashed.
+
+    Returns:
+        bytes: The salted, hashed password.
+    """
+    return await get_executor().hash_password_async(password)
+
+
+async def check_password_async(hashed_password: bytes,
+                               password: str) -> bool:
+    """
+    Validates a plain-text password against a hashed password
+    without blocking the event loop.
+
+    Args:
+        hashed_password: A byte string representing the hashed password.
+        password: A string representing the plain-text password to
+        be validated.
+
+    Returns:
+        bool: True if the plain-text password matches the hashed
+        password, False otherwise.
+    """
+    return await get_executor().check_password_async(password,
+                                                     hashed_password)
 
 
 if __name__ == "__main__":
@@ -2,57 +2,496 @@
 """
 Module for handling Personal Data
 """
-from typing import List
+from functools import lru_cache
+from typing import Callable, Iterable, Iterator, List, Mapping, Sequence
+import json
 import re
 import logging
-from os import environ
+import logging.handlers
+import queue
+import resource
+import sys
+import threading
+import time
+from os import environ, getpid
 import mysql.connector
+from db_pool import ConnectionPool
 
 PII_FIELDS = ("name", "email", "phone", "ssn", "password")
+REDACTOR_CACHE_SIZE = 128
+EXPORT_BATCH_SIZE = 1000
+DB_POOL_SIZE = 5
+_db_pool = None
+_db_pool_lock = threading.Lock()
+_logger_handler = None
+_logger_config = None
+_logger_lock = threading.Lock()
+
+
+class Redactor:
+    """Obfuscates `field=value<separator>` pairs with a compiled pattern
+
+    Values are replaced by `redaction`, or by the result of the field's
+    strategy (see redaction_strategies) when one is given.
+    """
+
+    def __init__(self, fields: Sequence[str], redaction: str,
+                 separator: str,
+                 strategies: Mapping[str, Callable] = None):
+        self.fields = tuple(fields)
+        self.redaction = redaction
+        self.separator = separator
+        self.strategies = dict(strategies or {})
+        if self.strategies:
+            self.pattern = re.compile(
+                f'({"|".join(self.fields)})=(.*?){separator}'
+            )
+            self.replacement = self._replace
+        else:
+            self.pattern = re.compile(
+                f'({"|".join(self.fields)})=.*?{separator}'
+            )
+            self.replacement = f'\\1={redaction}{separator}'
+
+    def mask(self, field: str, value) -> str:
+        """Returns what replaces the value of a redacted field"""
+        strategy = self.strategies.get(field)
+        return self.redaction if strategy is None else strategy(value)
+
+    def _replace(self, match: re.Match) -> str:
+        """Returns the replacement of one pair, applying its strategy"""
+        field = match.group(1)
+        return f'{field}={self.mask(field, match.group(2))}{self.separator}'
+
+    def redact(self, message: str) -> str:
+        """Returns the message with every listed field obfuscated"""
+        return self.pattern.sub(self.replacement, message)
+
+
+class ScanRedactor(Redactor):
+    """Obfuscates `field=value<separator>` pairs in a single linear pass
+
+    Field names are kept in a trie of their reversed spellings that is
+    walked back from each `=`, so the cost depends on the message length
+    and not on how many fields are listed. Unlike the regex engine, the
+    field names and the separator are matched literally.
+    """
+
+    def __init__(self, fields: Sequence[str], redaction: str,
+                 separator: str,
+                 strategies: Mapping[str, Callable] = None):
+        self.fields = tuple(fields)
+        self.redaction = redaction
+        self.separator = separator
+        self.strategies = dict(strategies or {})
+        self.trie = {}
+        for field in self.fields:
+            if not field or '=' in field:
+                raise ValueError(f"Can't scan for field name {field!r}")
+            node = self.trie
+            for char in reversed(field):
+                node = node.setdefault(char, {})
+            node[None] = True
+
+    def redact(self, message: str) -> str:
+        """Returns the message with every listed field obfuscated"""
+        separator = self.separator
+        masked = f'={self.redaction}{separator}'
+        parts = []
+        copied = 0
+        sep_at = newline_at = 0
+        equal = message.find('=')
+        while equal != -1:
+            begin = -1
+            node = self.trie
+            i = equal - 1
+            while i >= copied:
+                node = node.get(message[i])
+                if node is None:
+                    break
+                if None in node:
+                    begin = i
+                i -= 1
+            if begin != -1:
+                if -1 < sep_at <= equal:
+                    sep_at = message.find(separator, equal + 1)
+                if -1 < newline_at <= equal:
+                    newline_at = message.find('\n', equal + 1)
+                if sep_at != -1 and not -1 < newline_at < sep_at:
+                    parts.append(message[copied:equal])
+                    if self.strategies:
+                        value = self.mask(message[begin:equal],
+                                          message[equal + 1:sep_at])
+                        masked = f'={value}{separator}'
+                    parts.append(masked)
+                    copied = sep_at + len(separator)
+                    equal = message.find('=', copied)
+                    continue
+            equal = message.find('=', equal + 1)
+        if not parts:
+            return message
+        parts.append(message[copied:])
+        return ''.join(parts)
+
+
+REDACTION_ENGINES = {"regex": Redactor, "scan": ScanRedactor}
+
+
+@lru_cache(maxsize=REDACTOR_CACHE_SIZE)
+def _cached_redactor(fields: tuple, redaction: str, separator: str,
+                     engine: str, strategies: tuple) -> Redactor:
+    """Builds the Redactor for one (fields, redaction, separator) key"""
+    return REDACTION_ENGINES[engine](fields, redaction, separator,
+                                     dict(strategies))
+
+
+def get_redactor(fields: Sequence[str], redaction: str,
+                 separator: str, engine: str = "regex",
+                 strategies: Mapping[str, Callable] = None) -> Redactor:
+    """Returns a shared, already compiled Redactor for these settings"""
+    strategies = tuple(sorted(strategies.items())) if strategies else ()
+    return _cached_redactor(tuple(fields), redaction, separator, engine,
+                            strategies)
 
 
 def filter_datum(fields: List[str], redaction: str,
-                 message: str, separator: str) -> str:
+                 message: str, separator: str,
+                 engine: str = "regex") -> str:
     """Returns a log message obfuscated"""
-    pattern = f'({"|".join(fields)})=.*?{separator}'
-    replacement = f'\\1={redaction}{separator}'
-    return re.sub(pattern, replacement, message)
+    return get_redactor(fields, redaction, separator, engine).redact(message)
 
 
 class RedactingFormatter(logging.Formatter):
-    """Redacting Formatter class"""
+    """Redacting Formatter class
+
+    Records whose message is a mapping (`logger.info(row)`) or that carry
+    one in `extra={"row": row}` are redacted by key lookup and serialized
+    once, as `key=value;` pairs or, with output="json", as JSON lines.
+    """
 
     REDACTION = "***"
     FORMAT = "[HOLBERTON] %(name)s %(levelname)s %(asctime)-15s: %(message)s"
     SEPARATOR = ";"
+    OUTPUTS = ("kv", "json")
 
-    def __init__(self, fields: List[str]):
+    def __init__(self, fields: List[str], engine: str = "regex",
+                 output: str = "kv",
+                 strategies: Mapping[str, Callable] = None):
         super(RedactingFormatter, self).__init__(self.FORMAT)
+        if output not in self.OUTPUTS:
+            raise ValueError(f"Unknown output {output!r}")
         self.fields = fields
+        self.field_set = frozenset(fields)
+        self.output = output
+        self.redactor = get_redactor(fields, self.REDACTION,
+                                     self.SEPARATOR, engine, strategies)
+        self.cache_key = (tuple(fields), self.REDACTION, self.SEPARATOR,
+                          engine)
+        if strategies:
+            # Strategies are told apart by identity, which only holds
+            # within this process
+            self.cache_key += (getpid(), tuple(sorted(
+                (field, id(strategy))
+                for field, strategy in strategies.items())))
+
+    def redact_row(self, row: Mapping) -> dict:
+        """Returns a copy of the row with the PII fields obfuscated"""
+        field_set = self.field_set
+        if self.redactor.strategies:
+            mask = self.redactor.mask
+            return {key: mask(key, value) if key in field_set else value
+                    for key, value in row.items()}
+        redaction = self.REDACTION
+        return {key: redaction if key in field_set else value
+                for key, value in row.items()}
+
+    def serialize_row(self, row: Mapping) -> str:
+        """Returns the row redacted and serialized as `key=value;` pairs"""
+        separator = self.SEPARATOR
+        if self.redactor.strategies:
+            return ' '.join(f'{key}={value}{separator}'
+                            for key, value in self.redact_row(row).items())
+        field_set = self.field_set
+        redaction = self.REDACTION
+        return ' '.join(
+            f'{key}={redaction if key in field_set else value}{separator}'
+            for key, value in row.items()
+        )
+
+    def redacted_message(self, record: logging.LogRecord):
+        """Returns the redacted message of the record
+
+        The result is cached on the record, keyed by a plain tuple of the
+        redaction settings, so every handler sharing these settings
+        redacts a record only once, and the record can still be pickled,
+        e.g. by a SocketHandler. The record's own msg and args are left
+        untouched.
+        """
+        row = getattr(record, "row", None)
+        if row is None and isinstance(record.msg, Mapping):
+            row = record.msg
+        key = self.cache_key
+        if row is not None:
+            key += (self.output,)
+        cache = record.__dict__.setdefault("_redacted", {})
+        message = cache.get(key)
+        if message is None:
+            if row is None:
+                message = self.redactor.redact(record.getMessage())
+            elif self.output == "json":
+                message = self.redact_row(row)
+            else:
+                message = self.serialize_row(row)
+            cache[key] = message
+        return message
 
     def format(self, record: logging.LogRecord) -> str:
         """Filters values in incoming log records using filter_datum"""
-        record.msg = filter_datum(
-            self.fields, self.REDACTION, record.getMessage(), self.SEPARATOR
-        )
-        return super(RedactingFormatter, self).format(record)
+        if self.output == "json":
+            return self.format_json(record)
+        record.message = self.redacted_message(record)
+        if self.usesTime():
+            record.asctime = self.formatTime(record, self.datefmt)
+        formatted = self.formatMessage(record)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            if formatted[-1:] != "\n":
+                formatted += "\n"
+            formatted += record.exc_text
+        if record.stack_info:
+            if formatted[-1:] != "\n":
+                formatted += "\n"
+            formatted += self.formatStack(record.stack_info)
+        return formatted
+
+    def format_json(self, record: logging.LogRecord) -> str:
+        """Returns the record as one redacted JSON line"""
+        entry = {
+            "name": record.name,
+            "levelname": record.levelname,
+            "asctime": self.formatTime(record, self.datefmt),
+            "message": self.redacted_message(record),
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class BoundedLogQueue(queue.Queue):
+    """Bounded record queue that applies an overflow policy when full
+
+    "block" makes the caller wait for room, "drop-oldest" evicts the
+    oldest queued record and "drop-new" discards the incoming one.
+    """
+
+    OVERFLOW_POLICIES = ("block", "drop-oldest", "drop-new")
+
+    def __init__(self, maxsize: int = 10000, overflow: str = "block"):
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy {overflow!r}")
+        super(BoundedLogQueue, self).__init__(maxsize)
+        self.overflow = overflow
+        self.dropped_oldest = 0
+        self.dropped_new = 0
+
+    def offer(self, item) -> bool:
+        """Enqueues an item; returns False if it was dropped"""
+        if self.overflow == "block":
+            self.put(item)
+            return True
+        with self.not_full:
+            if 0 < self.maxsize <= self._qsize():
+                if self.overflow == "drop-new":
+                    self.dropped_new += 1
+                    return False
+                self._get()
+                self.dropped_oldest += 1
+            else:
+                self.unfinished_tasks += 1
+            self._put(item)
+            self.not_empty.notify()
+        return True
+
+
+class BatchingListener:
+    """Background thread that formats and writes queued records in batches
+
+    Redaction happens here, through the target handler's formatter, and
+    each batch is written to the stream with a single write and flush.
+    """
 
+    def __init__(self, record_queue: queue.Queue,
+                 handler: logging.StreamHandler, batch_size: int = 256):
+        self.queue = record_queue
+        self.handler = handler
+        self.batch_size = batch_size
+        self.batches = 0
+        self._thread = None
 
-def get_logger() -> logging.Logger:
-    """Returns a Logger Object"""
+    def start(self):
+        """Starts the listener thread"""
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name="user_data-listener")
+        self._thread.start()
+
+    def drain(self):
+        """Waits until every record queued so far is written"""
+        if self._thread is not None:
+            self.queue.join()
+
+    def stop(self):
+        """Writes every queued record, then stops the listener thread"""
+        if self._thread is None:
+            return
+        self.queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        """Drains the queue until the stop sentinel is received"""
+        running = True
+        while running:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            taken = len(batch)
+            if None in batch:
+                running = False
+                batch = [record for record in batch if record is not None]
+            if batch:
+                self._write(batch)
+            for _ in range(taken):
+                self.queue.task_done()
+
+    def _write(self, batch: List[logging.LogRecord]):
+        """Formats a batch of records and writes it in one call"""
+        handler = self.handler
+        lines = []
+        for record in batch:
+            if record.levelno < handler.level or not handler.filter(record):
+                continue
+            try:
+                lines.append(handler.format(record))
+            except Exception:
+                handler.handleError(record)
+        if not lines:
+            return
+        terminator = handler.terminator
+        handler.acquire()
+        try:
+            handler.stream.write(terminator.join(lines) + terminator)
+            handler.flush()
+        except Exception:
+            handler.handleError(batch[-1])
+        finally:
+            handler.release()
+        self.batches += 1
+
+
+class RedactingQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler whose callers only enqueue the raw record
+
+    Formatting, and so redaction, is left to the BatchingListener.
+    Closing the handler (logging.shutdown does it at exit) drains the
+    queue.
+    """
+
+    def __init__(self, record_queue: BoundedLogQueue,
+                 listener: BatchingListener):
+        super(RedactingQueueHandler, self).__init__(record_queue)
+        self.listener = listener
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """Leaves the record untouched for the listener thread"""
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        """Enqueues the record following the queue overflow policy"""
+        self.queue.offer(record)
+
+    def stats(self) -> dict:
+        """Returns the queue depth and the drop counters"""
+        return {
+            "queued": self.queue.qsize(),
+            "dropped_oldest": self.queue.dropped_oldest,
+            "dropped_new": self.queue.dropped_new,
+            "batches": self.listener.batches,
+        }
+
+    def flush(self):
+        """Waits until every record queued so far is written"""
+        self.listener.drain()
+
+    def close(self):
+        """Stops the listener once every queued record is written"""
+        self.listener.stop()
+        super(RedactingQueueHandler, self).close()
+
+
+def get_logger(output: str = "kv", queued: bool = False,
+               maxsize: int = 10000, overflow: str = "block",
+               batch_size: int = 256,
+               strategies: Mapping[str, Callable] = None) -> logging.Logger:
+    """Returns a Logger Object
+
+    With queued=True, records go through a bounded queue to a background
+    thread that redacts and writes them in batches. `strategies` maps
+    fields to redaction strategies (see redaction_strategies).
+
+    Calls with the same settings reuse the handler, or pipeline, of the
+    first one. A call with other settings replaces it, draining the
+    queue of the previous pipeline first; handlers added by others are
+    left alone.
+    """
+    global _logger_handler, _logger_config
+    config = (output, queued, maxsize, overflow, batch_size,
+              dict(strategies or {}))
     logger = logging.getLogger("user_data")
-    logger.setLevel(logging.INFO)
-    logger.propagate = False
+    with _logger_lock:
+        if _logger_handler in logger.handlers:
+            if config == _logger_config:
+                return logger
+            logger.removeHandler(_logger_handler)
+            _logger_handler.close()
+        _logger_handler = _new_handler(*config)
+        _logger_config = config
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        logger.addHandler(_logger_handler)
+    return logger
 
+
+def _new_handler(output: str, queued: bool, maxsize: int, overflow: str,
+                 batch_size: int, strategies: Mapping[str, Callable]
+                 ) -> logging.Handler:
+    """Returns the handler, started if queued, for get_logger settings"""
     stream_handler = logging.StreamHandler()
-    stream_handler.setFormatter(RedactingFormatter(list(PII_FIELDS)))
-    logger.addHandler(stream_handler)
+    stream_handler.setFormatter(
+        RedactingFormatter(list(PII_FIELDS), output=output,
+                           strategies=strategies)
+    )
+    if not queued:
+        return stream_handler
 
-    return logger
+    record_queue = BoundedLogQueue(maxsize, overflow)
+    listener = BatchingListener(record_queue, stream_handler, batch_size)
+    listener.start()
+    return RedactingQueueHandler(record_queue, listener)
 
 
-def get_db() -> mysql.connector.connection.MySQLConnection:
-    """Returns a connector to a MySQL database"""
+def get_db(pooled: bool = False
+           ) -> mysql.connector.connection.MySQLConnection:
+    """Returns a connector to a MySQL database
+
+    With pooled=True the connection is checked out of the shared pool
+    (see get_db_pool) and goes back to it when closed.
+    """
+    if pooled:
+        return get_db_pool().acquire()
     username = environ.get("PERSONAL_DATA_DB_USERNAME", "root")
     password = environ.get("PERSONAL_DATA_DB_PASSWORD", "")
     host = environ.get("PERSONAL_DATA_DB_HOST", "localhost")
@@ -64,25 +503,87 @@ def get_db() -> mysql.connector.connection.MySQLConnection:
     return cnx
 
 
-def main():
+def get_db_pool() -> ConnectionPool:
+    """Returns the shared pool of get_db connections
+
+    Its size comes from PERSONAL_DATA_DB_POOL_SIZE.
+    """
+    global _db_pool
+    with _db_pool_lock:
+        if _db_pool is None:
+            size = int(environ.get("PERSONAL_DATA_DB_POOL_SIZE",
+                                   DB_POOL_SIZE))
+            _db_pool = ConnectionPool(get_db, size)
+        return _db_pool
+
+
+def fetch_rows(cursor, batch_size: int) -> Iterator[tuple]:
+    """Yields the cursor rows, fetched `batch_size` rows at a time"""
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield from rows
+
+
+def format_rows(rows: Iterable[tuple],
+                field_names: List[str]) -> Iterator[dict]:
+    """Yields each row as a mapping of column name to value"""
+    for row in rows:
+        yield dict(zip(field_names, row))
+
+
+def write_rows(rows: Iterable[Mapping], logger: logging.Logger) -> int:
+    """Logs each row, to be redacted by the formatter; returns the count"""
+    count = 0
+    for row in rows:
+        logger.info(row)
+        count += 1
+    return count
+
+
+def peak_rss() -> int:
+    """Returns the peak resident set size of this process, in bytes"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def main(batch_size: int = None):
     """
     Gets database connection using get_db; retrieves all rows
     users' table. Displays each row under a filtered format
+
+    Rows are streamed from an unbuffered cursor in `fetchmany` batches
+    (PERSONAL_DATA_BATCH_SIZE), so memory stays flat whatever the table
+    size, and handed to the queued logging pipeline, which redacts and
+    writes them on its own thread. The run ends with a rows/sec and peak
+    RSS summary.
     """
+    if batch_size is None:
+        batch_size = int(environ.get("PERSONAL_DATA_BATCH_SIZE",
+                                     EXPORT_BATCH_SIZE))
     db = get_db()
-    cursor = db.cursor()
+    cursor = db.cursor(buffered=False)
     cursor.execute("SELECT * FROM users;")
     field_names = [i[0] for i in cursor.description]
 
-    logger = get_logger()
+    logger = get_logger(queued=True)
 
-    for row in cursor:
-        str_row = ''.join(f'{f}={str(r)}; ' for r, f in zip(row, field_names))
-        logger.info(str_row.strip())
+    start = time.perf_counter()
+    rows = format_rows(fetch_rows(cursor, batch_size), field_names)
+    count = write_rows(rows, logger)
+    for handler in logger.handlers:
+        # Count the rows still queued in the pipeline as unwritten
+        handler.flush()
+    elapsed = time.perf_counter() - start
 
     cursor.close()
     db.close()
 
+    rate = count / elapsed if elapsed > 0 else 0.0
+    logger.info("exported %d rows in %.3fs (%.0f rows/sec, peak RSS %.1f MB)",
+                count, elapsed, rate, peak_rss() / 2 ** 20)
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+Parallel, partitioned export of the users table
+
+The table is split into ranges; each range is exported by a worker
+process with its own connection and redacting formatter into a shard
+file, optionally gzip-compressed. A manifest describing the shards is
+written at the end, and the shards can be merged into one file.
+
+With --order-by, the ranges are key ranges: their bounds are quantiles
+of the first key column, and each worker reads its range with a
+`WHERE key >= low AND key < high` predicate, so with an index on the key
+the server only scans that range. Without it, the ranges fall back to
+LIMIT/OFFSET over the table sorted by every column: each worker then
+makes the server sort the whole table and skip the rows before its
+range, so the server work grows with the number of workers and the
+export does not scale with them.
+"""
+from typing import Callable, List, Tuple
+import argparse
+import gzip
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import time
+from filtered_logger import (PII_FIELDS, RedactingFormatter, fetch_rows,
+                             format_rows, get_db)
+
+IDENTIFIER = re.compile(r'^\w+$')
+MANIFEST_NAME = "manifest.json"
+
+
+def plan_partitions(total: int, partitions: int) -> List[Tuple[int, int]]:
+    """Returns (offset, limit) ranges covering `total` rows"""
+    partitions = max(1, min(partitions, total))
+    size, extra = divmod(total, partitions)
+    ranges = []
+    offset = 0
+    for index in range(partitions):
+        limit = size + (1 if index < extra else 0)
+        ranges.append((offset, limit))
+        offset += limit
+    return ranges
+
+
+def plan_key_ranges(cursor, table: str, key: str, total: int,
+                    partitions: int) -> List[Tuple]:
+    """Returns (low, high) key ranges splitting `total` rows evenly
+
+    The bounds are quantiles of the key, looked up in key order (an
+    index scan when the key is indexed); None stands for an open end,
+    and rows whose key is NULL go to the first range. Repeated quantiles
+    are merged, so a range is never empty by construction.
+    """
+    partitions = max(1, min(partitions, total))
+    bounds = []
+    for index in range(1, partitions):
+        cursor.execute(
+            f"SELECT {key} FROM {table} WHERE {key} IS NOT NULL "
+            f"ORDER BY {key} LIMIT 1 OFFSET {index * total // partitions};"
+        )
+        row = cursor.fetchone()
+        if row is not None and (not bounds or row[0] > bounds[-1]):
+            bounds.append(row[0])
+    edges = [None] + bounds + [None]
+    return list(zip(edges, edges[1:]))
+
+
+def key_range_clause(key: str, low, high,
+                     placeholder: str) -> Tuple[str, tuple]:
+    """Returns the WHERE clause selecting a key range, and its params"""
+    if low is None:
+        if high is None:
+            return "", ()
+        return f"WHERE ({key} < {placeholder} OR {key} IS NULL)", (high,)
+    if high is None:
+        return f"WHERE {key} >= {placeholder}", (low,)
+    return (f"WHERE {key} >= {placeholder} AND {key} < {placeholder}",
+            (low, high))
+
+
+def _check_identifier(name: str) -> str:
+    """Returns the name if it is safe to put in a query as is"""
+    if not IDENTIFIER.match(name):
+        raise ValueError(f"Invalid SQL identifier {name!r}")
+    return name
+
+
+def shard_path(output_dir: str, table: str, index: int,
+               compress: bool) -> str:
+    """Returns the file path of one shard"""
+    suffix = ".log.gz" if compress else ".log"
+    return os.path.join(output_dir, f"{table}-{index:05d}{suffix}")
+
+
+def export_partition(task: dict) -> dict:
+    """Exports one key or offset range of the table into its shard file
+
+    Runs in a worker process: it opens its own connection through
+    `task["connect"]` and returns the shard description for the manifest.
+    """
+    formatter = RedactingFormatter(list(PII_FIELDS), output=task["output"])
+    opener = gzip.open if task["compress"] else open
+    digest = hashlib.sha256()
+    rows = 0
+
+    db = task["connect"]()
+    cursor = db.cursor()
+    if "key" in task:
+        where, params = key_range_clause(task["key"], task["low"],
+                                         task["high"], task["placeholder"])
+        cursor.execute(
+            f"SELECT * FROM {task['table']} {where} "
+            f"ORDER BY {task['order_by']};", params
+        )
+    else:
+        cursor.execute(
+            f"SELECT * FROM {task['table']} ORDER BY {task['order_by']} "
+            f"LIMIT {int(task['limit'])} OFFSET {int(task['offset'])};"
+        )
+    field_names = [i[0] for i in cursor.description]
+    with opener(task["path"], "wt", encoding="utf-8") as shard:
+        for row in format_rows(fetch_rows(cursor, task["batch_size"]),
+                               field_names):
+            if task["output"] == "json":
+                line = json.dumps(formatter.redact_row(row), default=str)
+            else:
+                line = formatter.serialize_row(row)
+            line += "\n"
+            shard.write(line)
+            digest.update(line.encode("utf-8"))
+            rows += 1
+    cursor.close()
+    db.close()
+
+    if "key" in task:
+        bounds = {"low": task["low"], "high": task["high"]}
+    else:
+        bounds = {"offset": task["offset"], "limit": task["limit"]}
+    return {
+        "path": os.path.basename(task["path"]),
+        **bounds,
+        "rows": rows,
+        "bytes": os.path.getsize(task["path"]),
+        "sha256": digest.hexdigest(),
+    }
+
+
+def parallel_export(output_dir: str, workers: int = None,
+                    partitions: int = None, compress: bool = False,
+                    table: str = "users", order_by: str = None,
+                    output: str = "kv", batch_size: int = 1000,
+                    connect: Callable = get_db,
+                    placeholder: str = "%s") -> dict:
+    """Exports the table over a process pool; returns the manifest
+
+    With `order_by`, comma separated key columns, the table is split in
+    ranges of its first column, which should be indexed; rows are
+    ordered by all of them within each range. Without it, the table is
+    split in offset ranges of its rows ordered by every column, which
+    costs each worker a sort of the whole table (see the module
+    docstring). `connect` must be a picklable callable returning a
+    DB-API connection whose parameter placeholder is `placeholder`.
+    """
+    start = time.perf_counter()
+    table = _check_identifier(table)
+    workers = workers or os.cpu_count() or 1
+    partitions = partitions or workers
+
+    db = connect()
+    cursor = db.cursor()
+    cursor.execute(f"SELECT COUNT(*) FROM {table};")
+    total = cursor.fetchone()[0]
+    cursor.execute(f"SELECT * FROM {table} LIMIT 0;")
+    columns = len(cursor.description)
+    cursor.fetchall()
+    if order_by is None:
+        order_by = ", ".join(str(i) for i in range(1, columns + 1))
+        ranges = [{"offset": offset, "limit": limit}
+                  for offset, limit in plan_partitions(total, partitions)]
+    else:
+        keys = [_check_identifier(name.strip())
+                for name in order_by.split(",")]
+        order_by = ", ".join(keys)
+        ranges = [{"key": keys[0], "low": low, "high": high,
+                   "placeholder": placeholder}
+                  for low, high in plan_key_ranges(cursor, table, keys[0],
+                                                   total, partitions)]
+    cursor.close()
+    db.close()
+
+    os.makedirs(output_dir, exist_ok=True)
+    tasks = [{
+        "connect": connect,
+        "table": table,
+        "order_by": order_by,
+        **bounds,
+        "path": shard_path(output_dir, table, index, compress),
+        "compress": compress,
+        "output": output,
+        "batch_size": batch_size,
+    } for index, bounds in enumerate(ranges)]
+
+    with multiprocessing.Pool(min(workers, len(tasks) or 1)) as pool:
+        shards = pool.map(export_partition, tasks)
+
+    elapsed = time.perf_counter() - start
+    manifest = {
+        "table": table,
+        "rows": sum(shard["rows"] for shard in shards),
+        "compressed": compress,
+        "output": output,
+        "workers": workers,
+        "elapsed": round(elapsed, 3),
+        "shards": shards,
+    }
+    with open(os.path.join(output_dir, MANIFEST_NAME), "w") as f:
+        json.dump(manifest, f, indent=2, default=str)
+    return manifest
+
+
+def merge_shards(output_dir: str, destination: str) -> int:
+    """Concatenates the shards listed in the manifest, in order
+
+    Gzip shards are concatenated as gzip members, which is itself a valid
+    gzip file. Returns the number of rows merged.
+    """
+    with open(os.path.join(output_dir, MANIFEST_NAME)) as f:
+        manifest = json.load(f)
+    with open(destination, "wb") as merged:
+        for shard in manifest["shards"]:
+            with open(os.path.join(output_dir, shard["path"]), "rb") as part:
+                shutil.copyfileobj(part, merged)
+    return manifest["rows"]
+
+
+def main():
+    """Runs the parallel export from the command line"""
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("output_dir", help="directory for shards")
+    parser.add_argument("-w", "--workers", type=int, default=None)
+    parser.add_argument("-p", "--partitions", type=int, default=None)
+    parser.add_argument("-z", "--gzip", action="store_true")
+    parser.add_argument("--order-by", default=None,
+                        help="comma separated key columns; the table is "
+                        "split in ranges of the first one, which should "
+                        "be indexed (default: offset ranges, which do "
+                        "not scale)")
+    parser.add_argument("--json", action="store_true",
+                        help="write JSON lines instead of key=value")
+    parser.add_argument("--merge", metavar="FILE", default=None,
+                        help="merge the shards into FILE once done")
+    args = parser.parse_args()
+
+    manifest = parallel_export(args.output_dir, args.workers,
+                               args.partitions, args.gzip,
+                               order_by=args.order_by,
+                               output="json" if args.json else "kv")
+    if args.merge:
+        merge_shards(args.output_dir, args.merge)
+    rate = manifest["rows"] / manifest["elapsed"] if manifest["elapsed"] \
+        else 0.0
+    print(f"exported {manifest['rows']} rows in {manifest['elapsed']}s "
+          f"({rate:.0f} rows/sec) over {len(manifest['shards'])} shards")
+
+
+if __name__ == '__main__':
+    main()
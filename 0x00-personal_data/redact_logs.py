@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Re-redacts existing log files written in the RedactingFormatter format
+
+The input is memory-mapped and split into chunks on line boundaries;
+the chunks are redacted in parallel worker processes and written to the
+output in their original order.
+"""
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Tuple
+import argparse
+import mmap
+import os
+import sys
+from filtered_logger import PII_FIELDS, RedactingFormatter, get_redactor
+
+CHUNK_SIZE = 16 * 2 ** 20
+
+
+def plan_chunks(path: str, chunk_size: int) -> List[Tuple[int, int]]:
+    """Returns (start, end) byte ranges of the file, cut after newlines"""
+    size = os.path.getsize(path)
+    chunk_size = max(chunk_size, 1)
+    if size == 0:
+        return []
+    chunks = []
+    with open(path, "rb") as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        start = 0
+        while start < size:
+            end = data.find(b"\n", min(start + chunk_size, size) - 1)
+            end = size if end == -1 else end + 1
+            chunks.append((start, end))
+            start = end
+    return chunks
+
+
+def redact_chunk(task: tuple) -> bytes:
+    """Redacts one byte range of the file; runs in a worker process"""
+    path, start, end, fields, engine = task
+    redactor = get_redactor(fields, RedactingFormatter.REDACTION,
+                            RedactingFormatter.SEPARATOR, engine)
+    with open(path, "rb") as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        text = data[start:end].decode("utf-8", "surrogateescape")
+    return redactor.redact(text).encode("utf-8", "surrogateescape")
+
+
+def redact_file(path: str, output, fields: Tuple[str, ...] = PII_FIELDS,
+                engine: str = "regex", workers: int = None,
+                chunk_size: int = CHUNK_SIZE) -> int:
+    """Redacts the file into the binary `output` stream
+
+    At most two chunks per worker are in flight, so memory stays bounded
+    by the chunk size. Returns the number of bytes written.
+    """
+    workers = workers or os.cpu_count() or 1
+    tasks = ((path, start, end, tuple(fields), engine)
+             for start, end in plan_chunks(path, chunk_size))
+    written = 0
+    with ProcessPoolExecutor(workers) as executor:
+        for chunk in _ordered(executor, tasks, 2 * workers):
+            output.write(chunk)
+            written += len(chunk)
+    return written
+
+
+def _ordered(executor: ProcessPoolExecutor, tasks: Iterator[tuple],
+             window: int) -> Iterator[bytes]:
+    """Yields the redacted chunks in order, keeping `window` in flight"""
+    pending = deque()
+    for task in tasks:
+        pending.append(executor.submit(redact_chunk, task))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def main():
+    """Runs the redaction from the command line"""
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("input", help="log file to redact")
+    parser.add_argument("output", help="redacted file, or - for stdout")
+    parser.add_argument("-f", "--fields", default=",".join(PII_FIELDS),
+                        help="comma separated fields to redact")
+    parser.add_argument("-e", "--engine", default="regex",
+                        choices=("regex", "scan"))
+    parser.add_argument("-w", "--workers", type=int, default=None)
+    parser.add_argument("-c", "--chunk-size", type=int,
+                        default=CHUNK_SIZE // 2 ** 20,
+                        help="chunk size in MiB")
+    args = parser.parse_args()
+
+    fields = tuple(field for field in args.fields.split(",") if field)
+    chunk_size = args.chunk_size * 2 ** 20
+    if args.output == "-":
+        redact_file(args.input, sys.stdout.buffer, fields, args.engine,
+                    args.workers, chunk_size)
+    else:
+        with open(args.output, "wb") as output:
+            redact_file(args.input, output, fields, args.engine,
+                        args.workers, chunk_size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+Benchmarks of the redaction code of filtered_logger
+
+Covers filter_datum (per engine) across message size, field list size,
+match density and separator, RedactingFormatter.format, the main()
+export loop and the redaction strategies. Each case reports ns/record,
+records/sec and the peak bytes allocated per record; results can be
+saved as a JSON baseline and compared against one to flag regressions.
+"""
+from typing import Callable, Dict, List
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import time
+import tracemalloc
+from filtered_logger import (PII_FIELDS, RedactingFormatter, filter_datum,
+                             format_rows, fetch_rows, write_rows)
+from redaction_strategies import FixedMask, HmacToken, PartialMask
+
+MESSAGE_SIZES = (100, 1000, 10000, 100000, 1000000)
+FIELD_COUNTS = (5, 50, 500)
+DENSITIES = (0.0, 0.1, 0.5, 1.0)
+SEPARATORS = (";", ",", "; ")
+BASE_CASE = {"size": 1000, "fields": 5, "density": 0.5, "separator": ";"}
+ENGINES = ("regex", "scan")
+THRESHOLD = 0.10
+
+
+def sample_rows(count: int, distinct: int, seed: int = 0) -> List[dict]:
+    """Returns users rows drawn from `distinct` different users"""
+    rng = random.Random(seed)
+    users = [{
+        "name": f"User {i}",
+        "email": f"user{i}@example.com",
+        "phone": f"({rng.randint(200, 999)}) {rng.randint(200, 999)}-"
+                 f"{rng.randint(1000, 9999)}",
+        "ssn": f"{rng.randint(100, 999)}-{rng.randint(10, 99)}-"
+               f"{rng.randint(1000, 9999)}",
+        "password": f"pw{rng.getrandbits(32):x}",
+        "ip": f"10.0.{i % 256}.{rng.randint(1, 254)}",
+        "last_login": "2019-11-14 06:14:24",
+        "user_agent": "Mozilla/5.0 (X11; Linux x86_64)",
+    } for i in range(distinct)]
+    return [rng.choice(users) for _ in range(count)]
+
+
+def to_message(row: dict, separator: str = ";") -> str:
+    """Returns the row as the clear `key=value;` message main() used"""
+    return " ".join(f"{key}={value}{separator}"
+                    for key, value in row.items())
+
+
+def field_list(count: int) -> List[str]:
+    """Returns `count` PII field names, starting with PII_FIELDS"""
+    extra = [f"pii_field_{i}" for i in range(count - len(PII_FIELDS))]
+    return list(PII_FIELDS[:count]) + extra
+
+
+def synthetic_message(size: int, fields: List[str], density: float,
+                      separator: str, seed: int = 0) -> str:
+    """Returns a `key=value` message of about `size` characters
+
+    About `density` of the pairs use a listed field.
+    """
+    rng = random.Random(seed)
+    pairs = []
+    length = 0
+    while length < size:
+        if rng.random() < density:
+            key = rng.choice(fields)
+        else:
+            key = f"attr_{rng.randint(0, 99)}"
+        pair = f"{key}=value-{rng.getrandbits(40):x}{separator}"
+        pairs.append(pair)
+        length += len(pair) + 1
+    return " ".join(pairs)
+
+
+def measure(func: Callable, records: list, repeat: int = 5) -> dict:
+    """Returns ns/record, records/sec and peak bytes allocated per record"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        for record in records:
+            func(record)
+        best = min(best, time.perf_counter_ns() - start)
+    ns = best / len(records)
+
+    sampled = records[:min(len(records), 100)]
+    peaks = 0
+    tracemalloc.start()
+    try:
+        for record in sampled:
+            current = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            func(record)
+            peaks += tracemalloc.get_traced_memory()[1] - current
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "ns_per_record": round(ns, 1),
+        "records_per_sec": round(1e9 / ns, 1) if ns else 0.0,
+        "alloc_bytes": round(peaks / len(sampled), 1),
+    }
+
+
+def _repetitions(size: int) -> int:
+    """Returns how many records of `size` characters to time"""
+    return max(3, min(2000, 2000000 // size))
+
+
+def bench_filter_datum() -> Dict[str, dict]:
+    """Returns filter_datum results, varying one dimension at a time"""
+    cases = [dict(BASE_CASE, size=size) for size in MESSAGE_SIZES]
+    cases += [dict(BASE_CASE, fields=count) for count in FIELD_COUNTS]
+    cases += [dict(BASE_CASE, density=density) for density in DENSITIES]
+    cases += [dict(BASE_CASE, separator=sep) for sep in SEPARATORS]
+    results = {}
+    for case in cases:
+        fields = field_list(case["fields"])
+        separator = case["separator"]
+        message = synthetic_message(case["size"], fields, case["density"],
+                                    separator)
+        records = [message] * _repetitions(case["size"])
+        for engine in ENGINES:
+            name = (f"filter_datum/{engine}/size={case['size']}"
+                    f"/fields={case['fields']}/density={case['density']}"
+                    f"/sep={separator!r}")
+            if name in results:
+                continue
+            results[name] = measure(
+                lambda msg: filter_datum(fields, "***", msg, separator,
+                                         engine), records)
+    return results
+
+
+def bench_formatter(count: int = 5000) -> Dict[str, dict]:
+    """Returns RedactingFormatter.format results per engine and input"""
+    rows = sample_rows(count, count)
+    results = {}
+    for engine in ENGINES:
+        for output in RedactingFormatter.OUTPUTS:
+            formatter = RedactingFormatter(list(PII_FIELDS), engine, output)
+            for kind in ("string", "row"):
+                records = [logging.LogRecord(
+                    "user_data", logging.INFO, None, None,
+                    row if kind == "row" else to_message(row), None, None
+                ) for row in rows]
+                results[f"format/{engine}/{output}/{kind}"] = measure(
+                    lambda record: formatter.format(_fresh(record)),
+                    records)
+    return results
+
+
+class _RowsCursor:
+    """In-memory cursor handing rows out through fetchmany"""
+
+    def __init__(self, rows: List[tuple]):
+        self.rows = rows
+        self.position = 0
+
+    def fetchmany(self, size: int) -> List[tuple]:
+        batch = self.rows[self.position:self.position + size]
+        self.position += size
+        return batch
+
+
+def bench_export(count: int = 20000, batch_size: int = 1000
+                 ) -> Dict[str, dict]:
+    """Returns results of the main() loop over an in-memory table
+
+    Rows are formatted, redacted and written to os.devnull.
+    """
+    rows = sample_rows(count, count)
+    field_names = list(rows[0])
+    table = [tuple(row.values()) for row in rows]
+
+    logger = logging.getLogger("user_data.benchmark")
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    with open(os.devnull, "w") as devnull:
+        handler = logging.StreamHandler(devnull)
+        handler.setFormatter(RedactingFormatter(list(PII_FIELDS)))
+        logger.addHandler(handler)
+        try:
+            def export(table: List[tuple]):
+                write_rows(format_rows(fetch_rows(_RowsCursor(table),
+                                                  batch_size),
+                                       field_names), logger)
+            result = measure(export, [table], repeat=3)
+        finally:
+            logger.removeHandler(handler)
+    result["ns_per_record"] = round(result["ns_per_record"] / count, 1)
+    result["records_per_sec"] = round(result["records_per_sec"] * count, 1)
+    result["alloc_bytes"] = round(result["alloc_bytes"] / count, 1)
+    return {f"export/batch={batch_size}": result}
+
+
+def strategy_formatters(key: bytes = b"benchmark") -> dict:
+    """Returns a formatter per redaction strategy to compare"""
+    fields = list(PII_FIELDS)
+    return {
+        "fixed": RedactingFormatter(fields),
+        "fixed-strategy": RedactingFormatter(
+            fields, strategies={f: FixedMask() for f in fields}),
+        "partial": RedactingFormatter(
+            fields, strategies={f: PartialMask(1, 2) for f in fields}),
+        "hmac": RedactingFormatter(
+            fields, strategies={f: HmacToken(key) for f in fields}),
+        "hmac-no-memo": RedactingFormatter(
+            fields, strategies={f: HmacToken(key, cache_size=0)
+                                for f in fields}),
+    }
+
+
+def bench_strategies(count: int = 20000, distinct: int = 1000
+                     ) -> Dict[str, dict]:
+    """Returns the results of each strategy, for string and row records"""
+    rows = sample_rows(count, distinct)
+    results = {}
+    for name, formatter in strategy_formatters().items():
+        for kind in ("string", "row"):
+            records = [logging.LogRecord(
+                "user_data", logging.INFO, None, None,
+                row if kind == "row" else to_message(row), None, None
+            ) for row in rows]
+            results[f"strategy/{name}/{kind}"] = measure(
+                lambda record: formatter.format(_fresh(record)), records)
+    return results
+
+
+def _fresh(record: logging.LogRecord) -> logging.LogRecord:
+    """Drops the per-record redaction cache so each run redacts again"""
+    record.__dict__.pop("_redacted", None)
+    return record
+
+
+SUITES = {
+    "filter": bench_filter_datum,
+    "format": bench_formatter,
+    "export": bench_export,
+    "strategies": bench_strategies,
+}
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict],
+            threshold: float = THRESHOLD) -> List[str]:
+    """Returns the cases more than `threshold` slower than the baseline"""
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if reference is None or not reference["ns_per_record"]:
+            continue
+        ratio = result["ns_per_record"] / reference["ns_per_record"] - 1
+        if ratio > threshold:
+            regressions.append(f"{name}: {ratio:+.1%}")
+    return regressions
+
+
+def main():
+    """Runs the benchmarks from the command line"""
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("suites", nargs="*",
+                        help=f"suites to run among {', '.join(SUITES)} "
+                             f"(default: all)")
+    parser.add_argument("--save-baseline", metavar="FILE",
+                        help="write the results to FILE as JSON")
+    parser.add_argument("--compare", metavar="FILE",
+                        help="flag regressions against the FILE baseline")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD,
+                        help="allowed slowdown ratio (default: 0.10)")
+    args = parser.parse_args()
+    unknown = set(args.suites) - set(SUITES)
+    if unknown:
+        parser.error(f"unknown suites: {', '.join(sorted(unknown))}")
+
+    results = {}
+    for suite in args.suites or SUITES:
+        results.update(SUITES[suite]())
+    for name, result in results.items():
+        print(f"{name:64} {result['ns_per_record']:12.0f} ns/record "
+              f"{result['records_per_sec']:12.0f} rec/s "
+              f"{result['alloc_bytes']:10.0f} B")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
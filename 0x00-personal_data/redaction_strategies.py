@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Per-field redaction strategies for filtered_logger
+
+A strategy is a callable turning the clear value of a field into the
+text written to the log instead.
+"""
+from functools import lru_cache
+from os import environ
+import hashlib
+import hmac
+
+TOKEN_CACHE_SIZE = 65536
+
+
+class FixedMask:
+    """Replaces the whole value with the same mask"""
+
+    def __init__(self, mask: str = "***"):
+        self.mask = mask
+
+    def __call__(self, value) -> str:
+        return self.mask
+
+
+class PartialMask:
+    """Masks the value except its first and last few characters
+
+    Values too short to keep anything hidden are masked entirely.
+    """
+
+    def __init__(self, keep_start: int = 0, keep_end: int = 4,
+                 mask_char: str = "*"):
+        self.keep_start = keep_start
+        self.keep_end = keep_end
+        self.mask_char = mask_char
+
+    def __call__(self, value) -> str:
+        value = str(value)
+        hidden = len(value) - self.keep_start - self.keep_end
+        if hidden <= 0:
+            return self.mask_char * len(value)
+        end = value[len(value) - self.keep_end:] if self.keep_end else ""
+        return value[:self.keep_start] + self.mask_char * hidden + end
+
+
+class HmacToken:
+    """Replaces the value with a deterministic keyed-HMAC token
+
+    The same value always gives the same token for a given key, so lines
+    can be correlated without revealing the value. Tokens of recently
+    seen values are memoized in an LRU of `cache_size` entries.
+    """
+
+    def __init__(self, key: bytes = None, prefix: str = "tok_",
+                 length: int = 16, cache_size: int = TOKEN_CACHE_SIZE):
+        if key is None:
+            key = environ.get("PERSONAL_DATA_TOKEN_KEY", "").encode()
+        if not key:
+            raise ValueError("A token key is required "
+                             "(PERSONAL_DATA_TOKEN_KEY)")
+        self._key = key
+        self.prefix = prefix
+        self.length = length
+        self.token = lru_cache(maxsize=cache_size)(self._compute)
+
+    def _compute(self, value: str) -> str:
+        """Returns the token of a value, without the memo"""
+        digest = hmac.new(self._key, value.encode(), hashlib.sha256)
+        return self.prefix + digest.hexdigest()[:self.length]
+
+    def __call__(self, value) -> str:
+        return self.token(str(value))
+
+    def cache_info(self):
+        """Returns the hit and miss counters of the token memo"""
+        return self.token.cache_info()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Fuzz-equivalence tests of the filter_datum redaction engines
+"""
+import random
+import unittest
+from filtered_logger import filter_datum
+
+NAMES = ("name", "username", "nam", "e", "email", "mail", "ssn", "pass",
+         "password", "word", "a", "ab", "b")
+SEPARATORS = (";", ",", "; ", "&&", "::", "ab")
+REDACTIONS = ("***", "xxx", "")
+CHARS = "ab=;,: &\n"
+CASES = 20000
+
+
+def random_message(rng: random.Random, fields: tuple) -> str:
+    """Returns a message mixing field pairs, separators and noise"""
+    parts = []
+    for _ in range(rng.randrange(8)):
+        choice = rng.random()
+        if choice < 0.5:
+            parts.append(rng.choice(fields + NAMES) + "=")
+        elif choice < 0.7:
+            parts.append(rng.choice(SEPARATORS))
+        else:
+            parts.append("".join(rng.choice(CHARS)
+                                 for _ in range(rng.randrange(6))))
+    return "".join(parts)
+
+
+class TestScanEngine(unittest.TestCase):
+    """The scan engine gives the regex engine's output"""
+
+    def test_matches_regex_engine(self):
+        """Random fields, separators, newlines and overlapping names"""
+        rng = random.Random(20260418)
+        for _ in range(CASES):
+            fields = tuple(rng.sample(NAMES, rng.randrange(1, 6)))
+            separator = rng.choice(SEPARATORS)
+            redaction = rng.choice(REDACTIONS)
+            message = random_message(rng, fields)
+            with self.subTest(fields=fields, separator=separator,
+                              message=message):
+                self.assertEqual(
+                    filter_datum(list(fields), redaction, message,
+                                 separator, engine="scan"),
+                    filter_datum(list(fields), redaction, message,
+                                 separator, engine="regex"))
+
+    def test_examples(self):
+        """Redacts listed fields and leaves the rest untouched"""
+        message = "name=bob;email=bob@x.io;date=1/1;\nssn=1;password=p"
+        for engine in ("regex", "scan"):
+            self.assertEqual(
+                filter_datum(["name", "ssn", "password"], "xxx", message,
+                             ";", engine=engine),
+                "name=xxx;email=bob@x.io;date=1/1;\nssn=xxx;password=p")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,11 +3,157 @@
 Basic_auth module
 """
 from api.v1.auth.auth import Auth
+from models.base import Base
 from models.user import User
+from collections import OrderedDict
+from threading import Lock
 import base64
+import hashlib
+import os
+import time
 from typing import TypeVar
 
 
+class CredentialCache:
+    """
+    Bounded TTL cache of verified Authorization headers.
+
+    Entries map a keyed hash of the full header value to the user ID, so
+    the cache never holds the credentials themselves. Entries of a user
+    are dropped whenever that user is saved or removed.
+
+    A header verified while its user changes must not be cached: callers
+    read `generation()` before verifying and pass it to `put`, which
+    skips the entry if the user changed since. Changes are tracked per
+    stripe of user IDs, so the tracking stays bounded; a change to
+    another user of the same stripe only skips one put.
+    """
+    def __init__(self, max_entries: int = 10000, ttl: float = 300,
+                 stripes: int = 4096):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._key = os.urandom(32)
+        self._entries = OrderedDict()
+        self._by_user = {}
+        self._lock = Lock()
+        self._generation = 0
+        self._changed_at = [0] * stripes
+        self._cleared_at = 0
+
+    def _digest(self, authorization_header: str) -> bytes:
+        """
+        Returns the keyed hash of an Authorization header.
+        """
+        return hashlib.blake2b(authorization_header.encode(),
+                               key=self._key, digest_size=16).digest()
+
+    def get(self, authorization_header: str) -> str:
+        """
+        Returns the user ID verified for this header, or None.
+        """
+        digest = self._digest(authorization_header)
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                return None
+            user_id, expires_at = entry
+            if expires_at < time.monotonic():
+                self._drop(digest)
+                return None
+            self._entries.move_to_end(digest)
+            return user_id
+
+    def generation(self) -> int:
+        """
+        Returns the current generation, to pass to put.
+        """
+        with self._lock:
+            return self._generation
+
+    def _stripe(self, user_id: str) -> int:
+        """
+        Returns the stripe of a user ID.
+        """
+        return hash(user_id) % len(self._changed_at)
+
+    def put(self, authorization_header: str, user_id: str,
+            generation: int):
+        """
+        Remembers that this header authenticates the user, unless the
+        user changed after `generation` was read.
+        """
+        digest = self._digest(authorization_header)
+        with self._lock:
+            changed_at = max(self._cleared_at,
+                             self._changed_at[self._stripe(user_id)])
+            if changed_at > generation:
+                return
+            self._drop(digest)
+            self._entries[digest] = (user_id, time.monotonic() + self.ttl)
+            self._by_user.setdefault(user_id, set()).add(digest)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate_user(self, user_id: str):
+        """
+        Forgets every header verified for the user.
+        """
+        with self._lock:
+            self._generation += 1
+            self._changed_at[self._stripe(user_id)] = self._generation
+            for digest in self._by_user.pop(user_id, ()):
+                self._entries.pop(digest, None)
+
+    def clear(self):
+        """
+        Forgets every header.
+        """
+        with self._lock:
+            self._generation += 1
+            self._cleared_at = self._generation
+            self._entries.clear()
+            self._by_user.clear()
+
+    def _drop(self, digest: bytes):
+        """
+        Removes one entry; the lock must be held.
+        """
+        entry = self._entries.pop(digest, None)
+        if entry is None:
+            return
+        digests = self._by_user.get(entry[0])
+        if digests is not None:
+            digests.discard(digest)
+            if not digests:
+                del self._by_user[entry[0]]
+
+
+CREDENTIAL_CACHE = CredentialCache(
+    int(os.getenv('BASIC_AUTH_CACHE_SIZE', 10000)),
+    float(os.getenv('BASIC_AUTH_CACHE_TTL', 300))
+)
+
+
+def _invalidate_credentials(obj):
+    """
+    Drops the cached credentials of a saved or removed User.
+    """
+    if isinstance(obj, User):
+        CREDENTIAL_CACHE.invalidate_user(obj.id)
+
+
+def _clear_credentials(cls):
+    """
+    Drops all cached credentials once the users are reloaded.
+    """
+    if issubclass(cls, User):
+        CREDENTIAL_CACHE.clear()
+
+
+Base.add_change_listener(_invalidate_credentials)
+Base.add_load_listener(_clear_credentials)
+
+
 class BasicAuth(Auth):
     """
     BasicAuth class for managing basic authentication.
@@ -139,6 +285,12 @@ class BasicAuth(Auth):
         if auth_header is None:
             return None
 
+        user_id = CREDENTIAL_CACHE.get(auth_header)
+        if user_id is not None:
+            user = User.get(user_id)
+            if user is not None:
+                return user
+
         base64_auth = self.extract_base64_authorization_header(auth_header)
         if base64_auth is None:
             return None
@@ -151,4 +303,8 @@ class BasicAuth(Auth):
         if email is None or password is None:
             return None
 
-        return self.user_object_from_credentials(email, password)
+        generation = CREDENTIAL_CACHE.generation()
+        user = self.user_object_from_credentials(email, password)
+        if user is not None:
+            CREDENTIAL_CACHE.put(auth_header, user.id, generation)
+        return user
@@ -2,18 +2,123 @@
 """ Module of Users views
 """
 from api.v1.views import app_views
-from flask import abort, jsonify, request
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from flask import Response, abort, jsonify, request
+from models.base import parse_timestamp
 from models.user import User
+from typing import Iterator, Tuple
+from urllib.parse import urlencode
+import json
+
+MAX_PAGE_SIZE = 1000
+STREAM_BATCH_SIZE = 100
+STREAM_MIMETYPES = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def encode_cursor(user: User) -> str:
+    """ Return the cursor of the page that starts after user
+    """
+    created_at = user.created_at
+    if created_at is not None:
+        created_at = created_at.isoformat()
+    text = json.dumps([created_at, user.id])
+    return urlsafe_b64encode(text.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple:
+    """ Return the (created_at, id) a cursor starts after
+
+    Raises ValueError if the cursor is malformed.
+    """
+    try:
+        padding = '=' * (-len(cursor) % 4)
+        created_at, user_id = json.loads(
+            urlsafe_b64decode(cursor + padding).decode())
+        if created_at is not None:
+            created_at = parse_timestamp(created_at)
+    except (TypeError, ValueError) as e:
+        raise ValueError("Invalid cursor") from e
+    if not isinstance(user_id, str) or getattr(created_at, 'tzinfo', None):
+        raise ValueError("Invalid cursor")
+    return created_at, user_id
+
+
+def stream_users(stream: str) -> Iterator[str]:
+    """ Yield all users as a JSON array or as JSON lines, in batches
+    """
+    if stream == 'json':
+        opening, separator, closing = '[', ', ', ']'
+    else:
+        opening, separator, closing = '', '\n', '\n'
+    yield opening
+    batch = []
+    first = True
+    for user in User.iter_search():
+        batch.append(json.dumps(user.to_json()))
+        if len(batch) == STREAM_BATCH_SIZE:
+            yield ('' if first else separator) + separator.join(batch)
+            batch = []
+            first = False
+    if batch:
+        yield ('' if first else separator) + separator.join(batch)
+        first = False
+    yield '' if first and stream == 'ndjson' else closing
 
 
 @app_views.route('/users', methods=['GET'], strict_slashes=False)
 def view_all_users() -> str:
     """ GET /api/v1/users
+    Query parameters (optional):
+      - limit: size of a page of users, ordered by creation date
+      - cursor: the next cursor of the previous page
+      - stream: `json` or `ndjson` to stream all users
     Return:
       - list of all User objects JSON represented
+      - with limit, a page of them; unless it is the last page, the
+        `X-Next-Cursor` header and a `Link` header with rel="next"
+        give the next one
+      - with stream, all of them, sent as they are serialized
+      - 400 if a parameter is invalid
     """
-    all_users = [user.to_json() for user in User.all()]
-    return jsonify(all_users)
+    limit = request.args.get('limit')
+    cursor = request.args.get('cursor')
+    stream = request.args.get('stream')
+    if stream is not None:
+        if stream not in STREAM_MIMETYPES:
+            return jsonify({'error': "stream must be json or ndjson"}), 400
+        if limit is not None or cursor is not None:
+            return jsonify({'error': "stream cannot be paginated"}), 400
+        return Response(stream_users(stream),
+                        mimetype=STREAM_MIMETYPES[stream])
+    if limit is None and cursor is None:
+        all_users = [user.to_json() for user in User.all()]
+        return jsonify(all_users)
+
+    try:
+        limit = int(limit) if limit is not None else MAX_PAGE_SIZE
+    except ValueError:
+        limit = 0
+    if limit < 1:
+        return jsonify({'error': "limit must be a positive integer"}), 400
+    limit = min(limit, MAX_PAGE_SIZE)
+    after = None
+    if cursor is not None:
+        try:
+            after = decode_cursor(cursor)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    users = User.query(order_by='created_at', limit=limit + 1, after=after)
+    response = jsonify([user.to_json() for user in users[:limit]])
+    if len(users) > limit:
+        next_cursor = encode_cursor(users[limit - 1])
+        next_url = "{}?{}".format(request.base_url, urlencode(
+            {'limit': limit, 'cursor': next_cursor}))
+        response.headers['X-Next-Cursor'] = next_cursor
+        response.headers['Link'] = '<{}>; rel="next"'.format(next_url)
+    return response
 
 
 @app_views.route('/users/<user_id>', methods=['GET'], strict_slashes=False)
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+""" Benchmarks of the model storage
+
+The load suite times loading the User store and measures its memory,
+per snapshot format and load mode, each in a fresh process so that its
+resident set size is its own; RSS is read from /proc (Linux). The
+memory suite compares the bytes taken per user by the __slots__ layout
+of User and by the __dict__ layout it had before.
+"""
+from datetime import datetime
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+import models.base as base
+from models.snapshot import json_to_binary
+from models.user import User
+
+FORMATS = ('json', 'binary')
+MODES = ('eager', 'lazy')
+
+
+class DictUser():
+    """ The layout of User before __slots__: a __dict__ of its fields,
+    with datetime timestamps
+    """
+
+    def __init__(self, **kwargs):
+        self.id = kwargs['id']
+        self.created_at = datetime.strptime(kwargs['created_at'],
+                                            base.TIMESTAMP_FORMAT)
+        self.updated_at = datetime.strptime(kwargs['updated_at'],
+                                            base.TIMESTAMP_FORMAT)
+        self.email = kwargs.get('email')
+        self._password = kwargs.get('_password')
+        self.first_name = kwargs.get('first_name')
+        self.last_name = kwargs.get('last_name')
+
+
+def users_json(count: int) -> dict:
+    """ Return `count` users as stored in .db_User.json
+
+    Names repeat across users, as they do in real stores.
+    """
+    now = datetime.utcnow().strftime(base.TIMESTAMP_FORMAT)
+    objs_json = {}
+    for i in range(count):
+        obj_id = str(uuid.uuid4())
+        objs_json[obj_id] = {
+            "id": obj_id,
+            "created_at": now,
+            "updated_at": now,
+            "email": "user{}@example.com".format(i),
+            "_password": "{:064x}".format(i),
+            "first_name": "First{}".format(i % 1000),
+            "last_name": "Last{}".format(i % 5000),
+        }
+    return objs_json
+
+
+def write_users(file_path: str, count: int) -> str:
+    """ Write a .db_User.json file holding `count` users
+
+    Return the ID of the first user.
+    """
+    objs_json = users_json(count)
+    with open(file_path, 'w') as f:
+        json.dump(objs_json, f)
+    return next(iter(objs_json))
+
+
+def timed(func) -> float:
+    """ Return the seconds func() takes
+    """
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def rss() -> float:
+    """ Return the resident set size of this process, in MB
+    """
+    with open('/proc/self/statm') as f:
+        pages = int(f.read().split()[1])
+    return pages * resource.getpagesize() / (1 << 20)
+
+
+def run_case(directory: str, snapshot_format: str, load_mode: str,
+             first_id: str) -> dict:
+    """ Load the store of directory; return the timings and RSS growth
+    """
+    os.chdir(directory)
+    base.SNAPSHOT_FORMAT = snapshot_format
+    base.LOAD_MODE = load_mode
+    rss_before = rss()
+    results = {'load s': timed(User.load_from_file)}
+    results['load MB'] = rss() - rss_before
+    results['first get s'] = timed(lambda: User.get(first_id))
+    results['first search s'] = timed(
+        lambda: User.search({'email': 'user0@example.com'}))
+    results['total MB'] = rss() - rss_before
+    return results
+
+
+def bytes_per_user(user_class: type, text: str) -> float:
+    """ Return the bytes each user of the JSON text takes once built
+
+    The strings decoded from the text are counted, as the users keep
+    them alive.
+    """
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        users = [user_class(**obj_json)
+                 for obj_json in json.loads(text).values()]
+        used = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    return (used - sys.getsizeof(users)) / len(users)
+
+
+def bench_memory(count: int):
+    """ Print the bytes per user of the __dict__ and __slots__ layouts
+    """
+    text = json.dumps(users_json(count))
+    for name, user_class in (('__dict__', DictUser), ('__slots__', User)):
+        print("{:9} {:10.1f} bytes/user".format(
+            name, bytes_per_user(user_class, text)))
+
+
+def bench_load(count: int):
+    """ Print the load timings and memory of each format and mode
+    """
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        json_path = os.path.join(tmp_dir, ".db_User.json")
+        first_id = write_users(json_path, count)
+        convert = timed(lambda: json_to_binary(
+            json_path, os.path.join(tmp_dir, ".db_User.bin")))
+        print("json -> binary conversion {:10.2f} s".format(convert))
+        for snapshot_format in FORMATS:
+            for load_mode in MODES:
+                with context.Pool(1) as pool:
+                    results = pool.apply(run_case, (
+                        tmp_dir, snapshot_format, load_mode, first_id))
+                print("{:6} {:5} ".format(snapshot_format, load_mode) +
+                      "  ".join("{} {:8.2f}".format(name, value)
+                                for name, value in results.items()))
+
+
+SUITES = {
+    "load": bench_load,
+    "memory": bench_memory,
+}
+
+
+def main():
+    """ Run the benchmarks from the command line
+    """
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("suites", nargs="*",
+                        help="suites to run among {} (default: all)".format(
+                            ", ".join(SUITES)))
+    parser.add_argument("--users", type=int, default=1000000,
+                        help="number of users in the store")
+    args = parser.parse_args()
+    unknown = set(args.suites) - set(SUITES)
+    if unknown:
+        parser.error("unknown suites: {}".format(", ".join(sorted(unknown))))
+
+    for suite in args.suites or SUITES:
+        SUITES[suite](args.users)
+
+
+if __name__ == '__main__':
+    main()
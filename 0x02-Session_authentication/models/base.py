@@ -1,20 +1,352 @@
 #!/usr/bin/env python3
 """ Base module
 """
-from datetime import datetime
-from typing import TypeVar, List, Iterable
-from os import path
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime, timedelta
+from itertools import chain, islice
+from typing import Iterator, TypeVar, List, Iterable, Tuple
+from os import getenv, path
+from threading import Condition, Lock, RLock, Thread
+from models.journal import Journal
+from models.snapshot import BinarySnapshot, write_snapshot
+import atexit
 import json
+import os
+import re
+import sys
+import traceback
 import uuid
 
 
 TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
+EPOCH = datetime(1970, 1, 1)
+SECOND = timedelta(seconds=1)
+UNSET = object()
+UNHASHABLE = object()
+QUERY_OPERATORS = ('eq', 'in', 'prefix', 'range')
 DATA = {}
+RAW = {}
+ORDER = {}
+INDEXES = {}
+SORTED_INDEXES = {}
+FIELDS = {}
+JOURNALS = {}
+CHANGE_LISTENERS = []
+LOAD_LISTENERS = []
+LOCKS = {}
+LOCKS_LOCK = Lock()
+STORAGE = getenv('DB_STORAGE', 'json')
+SNAPSHOT_FORMAT = getenv('DB_SNAPSHOT_FORMAT', 'json')
+LOAD_MODE = getenv('DB_LOAD_MODE', 'eager')
+LOAD_CHUNK_SIZE = 1 << 20
+JOURNAL_FSYNC = getenv('DB_JOURNAL_FSYNC', 'interval')
+JOURNAL_FSYNC_INTERVAL = float(getenv('DB_JOURNAL_FSYNC_INTERVAL', 1.0))
+JOURNAL_COMPACT_BYTES = int(getenv('DB_JOURNAL_COMPACT_BYTES', 16 << 20))
+WRITE_MODE = getenv('DB_WRITE_MODE', 'sync')
+FLUSH_INTERVAL_MS = int(getenv('DB_FLUSH_INTERVAL_MS', 50))
+FLUSH_MAX_CHANGES = int(getenv('DB_FLUSH_MAX_CHANGES', 1000))
+JSON_CACHE = getenv('DB_JSON_CACHE', '0') == '1'
+JSON_SPACE = re.compile(r'\s*')
+JSON_OPEN = re.compile(r'\s*(\{\s*)?')
+JSON_COLON = re.compile(r'\s*:\s*')
+JSON_NEXT = re.compile(r'\s*([,}])\s*')
+
+
+def parse_timestamp(value: str) -> datetime:
+    """ Parse a TIMESTAMP_FORMAT string, with fromisoformat as fast path
+
+    Datetimes, as decoded from binary snapshots, are returned as is.
+    """
+    if isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return datetime.strptime(value, TIMESTAMP_FORMAT)
+
+
+def _to_epoch(value: datetime) -> float:
+    """ Return a naive UTC datetime as epoch seconds; None stays None
+    """
+    if value is None:
+        return None
+    return (value - EPOCH) / SECOND
+
+
+def _from_epoch(value: float) -> datetime:
+    """ Return epoch seconds as a naive UTC datetime; None stays None
+    """
+    if value is None:
+        return None
+    return EPOCH + timedelta(seconds=value)
+
+
+class _Highest():
+    """ Compares above every value, to bound ranges of sorted indexes
+    """
+
+    def __lt__(self, other) -> bool:
+        return False
+
+    def __gt__(self, other) -> bool:
+        return True
+
+
+HIGHEST = _Highest()
+
+
+def _hash_key(value):
+    """ Return the key of a value in a hash index: the value itself, or
+    UNHASHABLE, the bucket of the values that cannot be hashed
+    """
+    try:
+        hash(value)
+    except TypeError:
+        return UNHASHABLE
+    return value
+
+
+def _lookup(index: dict, value) -> dict:
+    """ Return the objects of a hash index that may hold value
+
+    The objects holding unhashable values are always included, to be
+    checked by the caller. Raises TypeError if value cannot be hashed.
+    """
+    bucket = index.get(value, {})
+    overflow = index.get(UNHASHABLE)
+    if overflow:
+        bucket = {**bucket, **overflow}
+    return bucket
+
+
+def _sort_value(value) -> tuple:
+    """ Return (rank, value) ordering values of any types together
+
+    None comes first, then numbers, strings, naive and aware datetimes,
+    and last any other value, by type name and repr.
+    """
+    if value is None:
+        return (0, None)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    if isinstance(value, str):
+        return (2, value)
+    if isinstance(value, datetime):
+        return (3 if value.tzinfo is None else 4, value)
+    return (5, (type(value).__name__, repr(value)))
+
+
+def _sort_key(value, obj_id: str) -> tuple:
+    """ Return the sort key of a value, ties broken by ID
+    """
+    return _sort_value(value) + (obj_id,)
+
+
+def _prefix_end(prefix: str) -> str:
+    """ Return the smallest string above all those starting with prefix
+    """
+    stripped = prefix.rstrip(chr(sys.maxunicode))
+    if not stripped:
+        return None
+    return stripped[:-1] + chr(ord(stripped[-1]) + 1)
+
+
+def _parse_condition(key: str, operand) -> Tuple[str, str, object]:
+    """ Split a query condition `attr` or `attr__op` into (attr, op, operand)
+    """
+    attr, sep, op = key.rpartition('__')
+    if not sep:
+        attr, op = key, 'eq'
+    elif op not in QUERY_OPERATORS:
+        raise ValueError("Unknown query operator {}".format(op))
+    if op == 'in':
+        operand = list(operand)
+    elif op == 'range':
+        low, high = operand
+        operand = (low, high)
+    return attr, op, operand
+
+
+def _matches(value, op: str, operand) -> bool:
+    """ Tell whether a value meets a query condition
+    """
+    if op == 'eq':
+        return value == operand
+    if op == 'in':
+        return value in operand
+    if value is None:
+        return False
+    if op == 'prefix':
+        return (isinstance(value, str) and isinstance(operand, str) and
+                value.startswith(operand))
+    low, high = operand
+    try:
+        return ((low is None or low <= value) and
+                (high is None or value <= high))
+    except TypeError:
+        return False
+
+
+def iter_json_items(f, chunk_size: int = LOAD_CHUNK_SIZE
+                    ) -> Iterator[Tuple[str, dict]]:
+    """ Yield the (key, value) pairs of the JSON object stored in file f
+
+    The file is read chunk by chunk and each pair is decoded on its own
+    with the C scanner of the json module, so the whole text is never
+    held in memory at once.
+    """
+    scan_once = json.JSONDecoder().scan_once
+    buf = f.read(chunk_size)
+    eof = not buf
+    match = JSON_OPEN.match(buf)
+    while match.end() == len(buf) and not eof:
+        chunk = f.read(chunk_size)
+        eof = not chunk
+        buf += chunk
+        match = JSON_OPEN.match(buf)
+    if match.group(1) is None:
+        raise ValueError("Expected a JSON object")
+    pos = match.end()
+    if buf.startswith('}', pos):
+        return
+    while True:
+        try:
+            key, end = scan_once(buf, pos)
+            end = JSON_COLON.match(buf, end).end()
+            value, end = scan_once(buf, end)
+            match = JSON_NEXT.match(buf, end)
+            if match is None:
+                raise ValueError("Incomplete pair at {}".format(pos))
+        except (StopIteration, ValueError, AttributeError):
+            if eof:
+                raise ValueError("Invalid JSON object at {}".format(pos))
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            buf = buf[pos:] + chunk
+            pos = JSON_SPACE.match(buf).end()
+            continue
+        yield key, value
+        if match.group(1) == '}':
+            return
+        pos = match.end()
+
+
+class WriteBehind():
+    """ Background flusher of the changes saved in write-behind mode
+
+    Changes are grouped per class and persisted together, at most every
+    `interval_ms` milliseconds or as soon as `max_changes` are pending.
+    """
+
+    def __init__(self, interval_ms: int, max_changes: int):
+        """ Initialize a WriteBehind; its thread starts on the first change
+        """
+        self.interval = interval_ms / 1000
+        self.max_changes = max_changes
+        self._cond = Condition()
+        self._flush_lock = Lock()
+        self._pending = {}
+        self._changes = 0
+        self._thread = None
+
+    def add(self, cls: type, records: List[dict]):
+        """ Mark the class dirty, queuing its journal records if any
+        """
+        with self._cond:
+            entry = self._pending.setdefault(cls.__name__, (cls, []))
+            entry[1].extend(records)
+            self._changes += 1
+            if self._thread is None:
+                self._thread = Thread(target=self._run, daemon=True,
+                                      name="write-behind")
+                self._thread.start()
+            if self._changes == 1 or self._changes >= self.max_changes:
+                self._cond.notify()
+
+    def flush(self):
+        """ Persist every pending change now
+        """
+        with self._flush_lock:
+            with self._cond:
+                pending, self._pending = self._pending, {}
+                self._changes = 0
+            items = list(pending.items())
+            for i, (s_class, (cls, records)) in enumerate(items):
+                try:
+                    cls._commit(records)
+                except Exception:
+                    self._requeue(items[i:])
+                    raise
+
+    def _requeue(self, items: list):
+        """ Put changes that failed to flush back ahead of newer ones
+        """
+        with self._cond:
+            for s_class, (cls, records) in items:
+                entry = self._pending.setdefault(s_class, (cls, []))
+                entry[1][:0] = records
+                self._changes += 1
+
+    def _run(self):
+        """ Flush the pending changes in the background, forever
+        """
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending)
+                self._cond.wait_for(
+                    lambda: self._changes >= self.max_changes,
+                    self.interval)
+            try:
+                self.flush()
+            except Exception:
+                traceback.print_exc()
+
+
+WRITE_BEHIND = WriteBehind(FLUSH_INTERVAL_MS, FLUSH_MAX_CHANGES)
+atexit.register(WRITE_BEHIND.flush)
 
 
 class Base():
     """ Base class
+
+    Subclasses can declare secondary indexes in `__indexes__`, e.g.
+    `__indexes__ = ('email',)`; `search` then looks indexed attributes
+    up by value instead of scanning every object; objects whose
+    indexed attribute cannot be hashed are kept apart and always
+    checked. Attributes listed in `__sorted_indexes__`
+    are also kept sorted, which `query` uses for ordering, ranges and
+    prefixes.
+
+    With DB_STORAGE=journal, save and remove append one record to
+    `.db_<Class>.journal` instead of rewriting `.db_<Class>.json`; the
+    snapshot is rewritten once the journal outgrows
+    DB_JOURNAL_COMPACT_BYTES.
+
+    With DB_SNAPSHOT_FORMAT=binary, the snapshot is `.db_<Class>.bin`,
+    see models.snapshot; it is memory-mapped on load and records are
+    decoded on first access.
+
+    With DB_LOAD_MODE=lazy, load_from_file only keeps the raw records;
+    objects are built on first access, one by one through `get` and all
+    at once through `search`, `all` or a rewrite of the file.
+
+    Objects have no `__dict__`: subclasses list their fields in
+    `__slots__`, and timestamps are kept as epoch seconds, turned into
+    datetimes on access. String values of the fields listed in
+    `__interned__` are interned, so repeated values are stored once.
+
+    With DB_JSON_CACHE=1, the serialized form of an object is cached
+    until one of its attributes is set; see `to_json`.
+
+    With DB_WRITE_MODE=behind, save and remove only mark the class dirty
+    and return; a background thread persists the changes in groups, see
+    WriteBehind. `Base.flush()` persists them on demand, and they are
+    flushed at exit.
     """
+    __slots__ = ('id', '_created_at', '_updated_at', '_json_cache')
+    __indexes__ = ()
+    __sorted_indexes__ = ()
+    __interned__ = ()
 
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a Base instance
@@ -23,18 +355,74 @@ class Base():
         if DATA.get(s_class) is None:
             DATA[s_class] = {}
 
-        self.id = kwargs.get('id', str(uuid.uuid4()))
+        self.id = kwargs['id'] if 'id' in kwargs else str(uuid.uuid4())
         if kwargs.get('created_at') is not None:
-            self.created_at = datetime.strptime(kwargs.get('created_at'),
-                                                TIMESTAMP_FORMAT)
+            self.created_at = parse_timestamp(kwargs.get('created_at'))
         else:
             self.created_at = datetime.utcnow()
         if kwargs.get('updated_at') is not None:
-            self.updated_at = datetime.strptime(kwargs.get('updated_at'),
-                                                TIMESTAMP_FORMAT)
+            self.updated_at = parse_timestamp(kwargs.get('updated_at'))
         else:
             self.updated_at = datetime.utcnow()
 
+    @property
+    def created_at(self) -> datetime:
+        """ Getter of the creation time
+        """
+        return _from_epoch(self._created_at)
+
+    @created_at.setter
+    def created_at(self, value: datetime):
+        """ Setter of the creation time, kept as epoch seconds
+        """
+        self._created_at = _to_epoch(value)
+
+    @property
+    def updated_at(self) -> datetime:
+        """ Getter of the last update time
+        """
+        return _from_epoch(self._updated_at)
+
+    @updated_at.setter
+    def updated_at(self, value: datetime):
+        """ Setter of the last update time, kept as epoch seconds
+        """
+        self._updated_at = _to_epoch(value)
+
+    @classmethod
+    def _fields(cls) -> tuple:
+        """ Return the field names of the class, in declaration order
+        """
+        fields = FIELDS.get(cls)
+        if fields is None:
+            fields = ('id', 'created_at', 'updated_at')
+            for klass in reversed(cls.__mro__):
+                if issubclass(klass, Base) and klass is not Base:
+                    fields += tuple(
+                        name for name in klass.__dict__.get('__slots__', ())
+                        if name not in ('__dict__', '__weakref__'))
+            FIELDS[cls] = fields
+        return fields
+
+    def __setattr__(self, name: str, value):
+        """ Set an attribute, keeping the indexes of saved objects current
+        and dropping the cached serialized form
+        """
+        if name in self.__interned__ and type(value) is str:
+            value = sys.intern(value)
+        if (name in self.__indexes__ or name in self.__sorted_indexes__) \
+                and self._is_stored():
+            with self._lock():
+                if self._is_stored():
+                    self._unindex((name,))
+                    super().__setattr__(name, value)
+                    self._index((name,))
+                else:
+                    super().__setattr__(name, value)
+        else:
+            super().__setattr__(name, value)
+        object.__setattr__(self, '_json_cache', None)
+
     def __eq__(self, other: TypeVar('Base')) -> bool:
         """ Equality
         """
@@ -44,12 +432,48 @@ class Base():
             return False
         return (self.id == other.id)
 
+    def _json_entry(self, store: bool) -> list:
+        """ Return the [fields, text or None] cache entry of the object
+
+        A missing entry is built, and only kept if store is true.
+        """
+        cache = self._json_cache
+        if cache is None:
+            cache = [self._serialize(), None]
+            if store:
+                object.__setattr__(self, '_json_cache', cache)
+        return cache
+
     def to_json(self, for_serialization: bool = False) -> dict:
         """ Convert the object a JSON dictionary
+
+        With DB_JSON_CACHE=1, the serialized fields are cached until an
+        attribute of the object is set, and a copy is returned; values
+        mutated in place, like a list appended to, are not noticed.
+        """
+        cache = self._json_entry(JSON_CACHE)
+        if for_serialization:
+            return dict(cache[0])
+        return {key: value for key, value in cache[0].items()
+                if key[0] != '_'}
+
+    def to_json_text(self) -> str:
+        """ Return the object as JSON text, the way it is saved to file
+        """
+        cache = self._json_entry(JSON_CACHE)
+        if cache[1] is None:
+            cache[1] = json.dumps(cache[0])
+        return cache[1]
+
+    def _serialize(self) -> dict:
+        """ Return all the fields, with timestamps as strings
         """
         result = {}
-        for key, value in self.__dict__.items():
-            if not for_serialization and key[0] == '_':
+        values = ((key, getattr(self, key, UNSET)) for key in self._fields())
+        if hasattr(self, '__dict__'):
+            values = chain(values, self.__dict__.items())
+        for key, value in values:
+            if value is UNSET:
                 continue
             if type(value) is datetime:
                 result[key] = value.strftime(TIMESTAMP_FORMAT)
@@ -59,54 +483,326 @@ class Base():
 
     @classmethod
     def load_from_file(cls):
-        """ Load all objects from file
+        """ Load all objects from file, then replay the journal
+        """
+        Base.flush()
+        with cls._lock():
+            cls._load()
+        for callback in LOAD_LISTENERS:
+            callback(cls)
+
+    @classmethod
+    def _load(cls):
+        """ Load the snapshot and the journal; the class lock is held
         """
         s_class = cls.__name__
         file_path = ".db_{}.json".format(s_class)
         DATA[s_class] = {}
-        if not path.exists(file_path):
-            return
+        INDEXES.pop(s_class, None)
+        SORTED_INDEXES.pop(s_class, None)
+        binary_path = ".db_{}.bin".format(s_class)
+        if SNAPSHOT_FORMAT == 'binary' and path.exists(binary_path):
+            raw = BinarySnapshot(binary_path)
+        else:
+            raw = {}
+            if path.exists(file_path):
+                with open(file_path, 'r') as f:
+                    raw.update(iter_json_items(f))
+
+        for record in Journal.replay(".db_{}.journal".format(s_class)):
+            if record['op'] == 'save':
+                raw[record['id']] = record['data']
+            else:
+                raw.pop(record['id'], None)
+
+        RAW[s_class] = raw
+        ORDER[s_class] = list(raw)
+        if LOAD_MODE != 'lazy':
+            cls._materialize()
+
+    @classmethod
+    def _lock(cls) -> RLock:
+        """ Return the lock of the class
+
+        It is held while objects are built from raw records, indexes are
+        built, and objects are added to or removed from the store, so
+        that none of these sees the others half done.
+        """
+        s_class = cls.__name__
+        lock = LOCKS.get(s_class)
+        if lock is None:
+            with LOCKS_LOCK:
+                lock = LOCKS.setdefault(s_class, RLock())
+        return lock
+
+    @classmethod
+    def _materialize(cls):
+        """ Build the objects still held as raw records, in file order
 
-        with open(file_path, 'r') as f:
-            objs_json = json.load(f)
-            for obj_id, obj_json in objs_json.items():
-                DATA[s_class][obj_id] = cls(**obj_json)
+        The raw records are dropped only once the objects are in DATA.
+        """
+        s_class = cls.__name__
+        if ORDER.get(s_class) is None:
+            return
+        with cls._lock():
+            order = ORDER.get(s_class)
+            if order is None:
+                return
+            raw = RAW[s_class]
+            objs = DATA[s_class]
+            ordered = {}
+            for obj_id in order:
+                obj = objs.get(obj_id)
+                if obj is None and obj_id in raw:
+                    obj = cls(**raw[obj_id])
+                if obj is not None:
+                    ordered[obj_id] = obj
+            ordered.update(objs)
+            DATA[s_class] = ordered
+            del ORDER[s_class]
+            del RAW[s_class]
 
     @classmethod
     def save_to_file(cls):
         """ Save all objects to file
+
+        In journal mode this compacts: the journal is emptied once the
+        snapshot is written.
+        """
+        if STORAGE == 'journal':
+            cls._journal().compact(cls._write_snapshot)
+        else:
+            cls._write_snapshot()
+
+    @classmethod
+    def _write_snapshot(cls):
+        """ Write all objects to a temporary file renamed over the snapshot
+
+        Cached serialized forms are used, but none is added: a rewrite
+        would otherwise leave one on every object.
         """
+        cls._materialize()
         s_class = cls.__name__
+        objs = list(DATA[s_class].items())
+        if SNAPSHOT_FORMAT == 'binary':
+            write_snapshot(".db_{}.bin".format(s_class),
+                           ((obj_id, obj._json_entry(False)[0])
+                            for obj_id, obj in objs))
+            return
+
         file_path = ".db_{}.json".format(s_class)
-        objs_json = {}
-        for obj_id, obj in DATA[s_class].items():
-            objs_json[obj_id] = obj.to_json(True)
+        tmp_path = "{}.tmp".format(file_path)
+        with open(tmp_path, 'w') as f:
+            separator = '{'
+            for obj_id, obj in objs:
+                fields, text = obj._json_entry(False)
+                if text is None:
+                    text = json.dumps(fields)
+                f.write('{}{}: {}'.format(separator, json.dumps(obj_id),
+                                          text))
+                separator = ', '
+            f.write('}' if objs else '{}')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
 
-        with open(file_path, 'w') as f:
-            json.dump(objs_json, f)
+    @classmethod
+    def _journal(cls) -> Journal:
+        """ Return the journal of the class, opened on first use
+        """
+        s_class = cls.__name__
+        journal = JOURNALS.get(s_class)
+        if journal is None:
+            journal = Journal(".db_{}.journal".format(s_class),
+                              JOURNAL_FSYNC, JOURNAL_FSYNC_INTERVAL)
+            JOURNALS[s_class] = journal
+        return journal
+
+    @classmethod
+    def _commit(cls, records: List[dict]):
+        """ Persist changes: append the journal records or rewrite the file
+        """
+        if STORAGE != 'journal':
+            cls.save_to_file()
+        elif records:
+            if cls._journal().append_many(records) > JOURNAL_COMPACT_BYTES:
+                cls.save_to_file()
+
+    @staticmethod
+    def flush():
+        """ Persist the changes pending in write-behind mode
+        """
+        WRITE_BEHIND.flush()
+
+    def _persist(self, op: str):
+        """ Persist the save or removal of this object
+        """
+        records = []
+        if STORAGE == 'journal':
+            record = {'op': op, 'id': self.id}
+            if op == 'save':
+                record['data'] = self.to_json(True)
+            records.append(record)
+        if WRITE_MODE == 'behind':
+            WRITE_BEHIND.add(self.__class__, records)
+        else:
+            self.__class__._commit(records)
+
+    @classmethod
+    def _sorted_indexes(cls) -> dict:
+        """ Return the sorted indexes of the class, built on first use
+        """
+        s_class = cls.__name__
+        sorted_indexes = SORTED_INDEXES.get(s_class)
+        if sorted_indexes is not None:
+            return sorted_indexes
+        with cls._lock():
+            sorted_indexes = SORTED_INDEXES.get(s_class)
+            if sorted_indexes is None:
+                cls._materialize()
+                objs = list(DATA.get(s_class, {}).values())
+                sorted_indexes = {
+                    attr: sorted(_sort_key(getattr(obj, attr, None), obj.id)
+                                 for obj in objs)
+                    for attr in cls.__sorted_indexes__}
+                SORTED_INDEXES[s_class] = sorted_indexes
+        return sorted_indexes
+
+    @classmethod
+    def _indexes(cls) -> dict:
+        """ Return the hash indexes of the class, built on first use
+
+        Indexes are built from a snapshot of the objects under the class
+        lock, which save, remove and writes to indexed attributes also
+        take: a change made meanwhile waits for the index to be
+        published, then updates it.
+        """
+        s_class = cls.__name__
+        indexes = INDEXES.get(s_class)
+        if indexes is not None:
+            return indexes
+        with cls._lock():
+            indexes = INDEXES.get(s_class)
+            if indexes is None:
+                cls._materialize()
+                objs = list(DATA.get(s_class, {}).values())
+                indexes = {attr: {} for attr in cls.__indexes__}
+                for obj in objs:
+                    for attr in cls.__indexes__:
+                        value = _hash_key(getattr(obj, attr, None))
+                        indexes[attr].setdefault(value, {})[obj.id] = obj
+                INDEXES[s_class] = indexes
+        return indexes
+
+    def _is_stored(self) -> bool:
+        """ Tell whether this very object is the saved one for its ID
+        """
+        objs = DATA.get(self.__class__.__name__, {})
+        return objs.get(getattr(self, 'id', None)) is self
+
+    def _indexed_attrs(self) -> tuple:
+        """ Return the attributes with a hash or sorted index
+        """
+        return tuple(dict.fromkeys(self.__indexes__ +
+                                   self.__sorted_indexes__))
+
+    def _index(self, attrs: Iterable[str] = None):
+        """ Add the object to the built indexes of the given attributes
+        """
+        s_class = self.__class__.__name__
+        indexes = INDEXES.get(s_class, {})
+        sorted_indexes = SORTED_INDEXES.get(s_class, {})
+        for attr in attrs or self._indexed_attrs():
+            value = getattr(self, attr, None)
+            if attr in indexes:
+                indexes[attr].setdefault(_hash_key(value), {})[self.id] = self
+            if attr in sorted_indexes:
+                insort(sorted_indexes[attr], _sort_key(value, self.id))
+
+    def _unindex(self, attrs: Iterable[str] = None):
+        """ Remove the object from the indexes of the given attributes
+        """
+        s_class = self.__class__.__name__
+        indexes = INDEXES.get(s_class, {})
+        sorted_indexes = SORTED_INDEXES.get(s_class, {})
+        for attr in attrs or self._indexed_attrs():
+            value = getattr(self, attr, None)
+            hash_key = _hash_key(value)
+            bucket = indexes.get(attr, {}).get(hash_key)
+            if bucket is not None:
+                bucket.pop(self.id, None)
+                if not bucket:
+                    del indexes[attr][hash_key]
+            keys = sorted_indexes.get(attr)
+            if keys is not None:
+                key = _sort_key(value, self.id)
+                i = bisect_left(keys, key)
+                if i < len(keys) and keys[i] == key:
+                    del keys[i]
+
+    @staticmethod
+    def add_change_listener(callback):
+        """ Register a callback(obj) run after an object is saved or removed
+        """
+        CHANGE_LISTENERS.append(callback)
+
+    @staticmethod
+    def add_load_listener(callback):
+        """ Register a callback(cls) run after a class is loaded from file
+        """
+        LOAD_LISTENERS.append(callback)
+
+    def notify_change(self):
+        """ Run the change listeners for this object
+        """
+        for callback in CHANGE_LISTENERS:
+            callback(self)
 
     def save(self):
         """ Save current object
         """
         s_class = self.__class__.__name__
         self.updated_at = datetime.utcnow()
-        DATA[s_class][self.id] = self
-        self.__class__.save_to_file()
+        with self._lock():
+            stored = DATA[s_class].get(self.id)
+            if stored is not self:
+                if stored is not None:
+                    stored._unindex()
+                try:
+                    self._index()
+                except Exception:
+                    self._unindex()
+                    if stored is not None:
+                        stored._index()
+                    raise
+                DATA[s_class][self.id] = self
+            RAW.get(s_class, {}).pop(self.id, None)
+        self._persist('save')
+        self.notify_change()
 
     def remove(self):
         """ Remove object
         """
         s_class = self.__class__.__name__
-        if DATA[s_class].get(self.id) is not None:
-            del DATA[s_class][self.id]
-            self.__class__.save_to_file()
+        with self._lock():
+            stored = DATA[s_class].get(self.id)
+            raw = RAW.get(s_class, {}).pop(self.id, None)
+            if stored is not None:
+                stored._unindex()
+                del DATA[s_class][self.id]
+        if stored is not None or raw is not None:
+            self._persist('remove')
+            self.notify_change()
 
     @classmethod
     def count(cls) -> int:
         """ Count all objects
         """
         s_class = cls.__name__
-        return len(DATA[s_class].keys())
+        if s_class not in RAW:
+            return len(DATA[s_class].keys())
+        with cls._lock():
+            return len(DATA[s_class].keys()) + len(RAW.get(s_class, ()))
 
     @classmethod
     def all(cls) -> Iterable[TypeVar('Base')]:
@@ -119,13 +815,47 @@ class Base():
         """ Return one object by ID
         """
         s_class = cls.__name__
-        return DATA[s_class].get(id)
+        obj = DATA[s_class].get(id)
+        if obj is None and RAW.get(s_class):
+            with cls._lock():
+                obj = DATA[s_class].get(id)
+                raw = RAW.get(s_class)
+                if obj is None and raw:
+                    obj_json = raw.get(id)
+                    if obj_json is not None:
+                        obj = cls(**obj_json)
+                        DATA[s_class][id] = obj
+                        del raw[id]
+        return obj
 
     @classmethod
-    def search(cls, attributes: dict = {}) -> List[TypeVar('Base')]:
+    def search(cls, attributes: dict = None) -> List[TypeVar('Base')]:
         """ Search all objects with matching attributes
         """
+        return list(cls.iter_search(attributes))
+
+    @classmethod
+    def iter_search(cls, attributes: dict = None
+                    ) -> Iterator[TypeVar('Base')]:
+        """ Iterate over the objects with matching attributes
+
+        Indexed attributes narrow the search down to the smallest
+        matching bucket; other attributes are checked on that bucket.
+        """
+        if attributes is None:
+            attributes = {}
+        cls._materialize()
         s_class = cls.__name__
+        objs = DATA[s_class]
+        indexed = [k for k in attributes if k in cls.__indexes__]
+        if indexed:
+            indexes = cls._indexes()
+            try:
+                objs = min((_lookup(indexes[k], attributes[k])
+                            for k in indexed), key=len)
+            except TypeError:
+                pass
+
         def _search(obj):
             if len(attributes) == 0:
                 return True
@@ -133,5 +863,152 @@ class Base():
                 if (getattr(obj, k) != v):
                     return False
             return True
-        
-        return list(filter(_search, DATA[s_class].values()))
+
+        return filter(_search, list(objs.values()))
+
+    @classmethod
+    def query(cls, order_by: str = None, limit: int = None, offset: int = 0,
+              after: tuple = None, **conditions
+              ) -> List[TypeVar('Base')]:
+        """ Return the objects matching the conditions, see iter_query
+        """
+        return list(cls.iter_query(order_by, limit, offset, after,
+                                   **conditions))
+
+    @classmethod
+    def iter_query(cls, order_by: str = None, limit: int = None,
+                   offset: int = 0, after: tuple = None, **conditions
+                   ) -> Iterator[TypeVar('Base')]:
+        """ Iterate over the objects matching the conditions
+
+        Conditions are `attr=value` or `attr__op=value`, op being `eq`,
+        `in` (any of the values), `prefix` (strings starting with it) or
+        `range` (a (low, high) pair, both included, None for an open
+        end). `order_by` names an attribute, with a leading '-' for the
+        descending order; ties are broken by ID and None comes first.
+        Without it, objects come in storage order, or in the order of
+        the sorted index that narrows the search.
+
+        `offset` and `limit` cut a page out of the result; `after`, the
+        (value, id) of the last object of the previous page in the
+        `order_by` order, starts the page right after it instead.
+
+        Hash indexes serve `eq` and `in` conditions, sorted indexes
+        serve ordering, ranges and prefixes: a page ordered by a sorted
+        index costs O(log N + page size) rather than a scan.
+        """
+        filters = [_parse_condition(key, operand)
+                   for key, operand in conditions.items()]
+        descending = order_by is not None and order_by.startswith('-')
+        order_attr = order_by[1:] if descending else order_by
+        if after is not None and order_attr is None:
+            raise ValueError("after needs order_by")
+
+        s_class = cls.__name__
+        sorted_indexes = cls._sorted_indexes()
+        objs = cls._bucket(filters)
+        ordered = False
+        if objs is None:
+            narrowing = [attr for attr, op, _ in filters
+                         if attr in sorted_indexes and op != 'in']
+            if order_attr in sorted_indexes:
+                objs = cls._iter_sorted(order_attr, filters, descending,
+                                        after)
+                ordered = True
+            elif narrowing:
+                objs = cls._iter_sorted(narrowing[0], filters)
+            else:
+                objs = list(DATA[s_class].values())
+
+        objs = (obj for obj in objs
+                if all(_matches(getattr(obj, attr, None), op, operand)
+                       for attr, op, operand in filters))
+        if order_attr is not None and not ordered:
+            def key(obj):
+                return _sort_key(getattr(obj, order_attr, None), obj.id)
+            objs = sorted(objs, key=key, reverse=descending)
+            if after is not None:
+                after_key = _sort_key(*after)
+                objs = (obj for obj in objs
+                        if (key(obj) < after_key if descending
+                            else key(obj) > after_key))
+        stop = None if limit is None else offset + limit
+        return islice(objs, offset, stop)
+
+    @classmethod
+    def _bucket(cls, filters: list) -> list:
+        """ Return the smallest hash index bucket matching the filters,
+        or None if no filter has a hash index
+        """
+        indexes = cls._indexes()
+        buckets = []
+        for attr, op, operand in filters:
+            if attr not in indexes or op not in ('eq', 'in'):
+                continue
+            try:
+                if op == 'eq':
+                    buckets.append(_lookup(indexes[attr], operand))
+                else:
+                    bucket = {}
+                    for value in operand:
+                        bucket.update(_lookup(indexes[attr], value))
+                    buckets.append(bucket)
+            except TypeError:
+                continue
+        if not buckets:
+            return None
+        return list(min(buckets, key=len).values())
+
+    @classmethod
+    def _iter_sorted(cls, attr: str, filters: list,
+                     descending: bool = False, after: tuple = None
+                     ) -> Iterator[TypeVar('Base')]:
+        """ Iterate over the objects in the order of the sorted index of
+        attr, skipping the parts the filters on attr rule out
+        """
+        s_class = cls.__name__
+        keys = SORTED_INDEXES[s_class][attr]
+        start, end = 0, len(keys)
+        for f_attr, op, operand in filters:
+            if f_attr != attr:
+                continue
+            if op == 'eq':
+                low = _sort_value(operand)
+                high = low + (HIGHEST,)
+            elif op == 'prefix':
+                if not isinstance(operand, str):
+                    low = high = ()
+                else:
+                    prefix_end = _prefix_end(operand)
+                    low = (2, operand)
+                    high = (2, prefix_end) if prefix_end else (2, HIGHEST)
+            elif op == 'range':
+                low, high = [None if bound is None else _sort_value(bound)
+                             for bound in operand]
+                if low is None:
+                    low = (1,) if high is None else high[:1]
+                if high is None:
+                    high = (HIGHEST,) if operand[0] is None \
+                        else (low[0], HIGHEST)
+                else:
+                    high += (HIGHEST,)
+            else:
+                continue
+            start = max(start, bisect_left(keys, low))
+            end = min(end, bisect_left(keys, high))
+        if after is not None:
+            after_key = _sort_key(*after)
+            if descending:
+                end = min(end, bisect_left(keys, after_key))
+            else:
+                start = max(start, bisect_right(keys, after_key))
+
+        objs = DATA[s_class]
+        positions = range(end - 1, start - 1, -1) if descending \
+            else range(start, end)
+        for i in positions:
+            if i >= len(keys):
+                continue
+            obj = objs.get(keys[i][2])
+            if obj is not None:
+                yield obj
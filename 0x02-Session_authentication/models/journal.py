@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+""" Journal module
+"""
+from threading import Lock
+from typing import Callable, Iterator, List
+from os import path
+import json
+import os
+import time
+
+
+FSYNC_POLICIES = ('always', 'interval', 'never')
+
+
+class Journal():
+    """ Append-only log of changes, one JSON record per line
+
+    The fsync policy decides when appended records reach the disk:
+    `always` after every record, `interval` at most every
+    `fsync_interval` seconds, `never` leaves it to the OS. Records are
+    flushed to the OS on every append in all cases.
+
+    A record is only complete once its newline is written. Opening a
+    journal cuts off a torn last record, left by a crash in the middle
+    of a write, so that new records start on a line of their own.
+    """
+
+    def __init__(self, file_path: str, fsync: str = 'interval',
+                 fsync_interval: float = 1.0):
+        """ Initialize a Journal appending to file_path
+        """
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError("Unknown fsync policy {}".format(fsync))
+        self.file_path = file_path
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.lock = Lock()
+        self.truncate_torn_tail(file_path)
+        self._file = open(file_path, 'a')
+        self._synced_at = time.monotonic()
+
+    def append(self, record: dict) -> int:
+        """ Append a record and return the size of the journal in bytes
+        """
+        return self.append_many([record])
+
+    def append_many(self, records: List[dict]) -> int:
+        """ Append records in one write and return the journal size
+        """
+        lines = ''.join(json.dumps(record) + '\n' for record in records)
+        with self.lock:
+            self._file.write(lines)
+            self._file.flush()
+            if self.fsync == 'always':
+                os.fsync(self._file.fileno())
+            elif self.fsync == 'interval':
+                now = time.monotonic()
+                if now - self._synced_at >= self.fsync_interval:
+                    os.fsync(self._file.fileno())
+                    self._synced_at = now
+            return self._file.tell()
+
+    def compact(self, write_snapshot: Callable[[], None]):
+        """ Write a snapshot with write_snapshot, then empty the journal
+
+        Records appended while the snapshot is written wait for it, so
+        none is lost; replaying one already in the snapshot is harmless.
+        """
+        with self.lock:
+            write_snapshot()
+            self._file.seek(0)
+            self._file.truncate()
+            os.fsync(self._file.fileno())
+            self._synced_at = time.monotonic()
+
+    def close(self):
+        """ Flush, sync and close the journal file
+        """
+        with self.lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+
+    @staticmethod
+    def truncate_torn_tail(file_path: str):
+        """ Cut a journal file back to its last newline-terminated record
+        """
+        if not path.exists(file_path):
+            return
+        with open(file_path, 'rb+') as f:
+            end = f.seek(0, os.SEEK_END)
+            size = end
+            while size > 0:
+                start = max(0, size - 4096)
+                f.seek(start)
+                chunk = f.read(size - start)
+                newline = chunk.rfind(b'\n')
+                if newline != -1:
+                    size = start + newline + 1
+                    break
+                size = start
+            if size != end:
+                f.truncate(size)
+                f.flush()
+                os.fsync(f.fileno())
+
+    @staticmethod
+    def replay(file_path: str) -> Iterator[dict]:
+        """ Yield the records of a journal file in order
+
+        A torn last record, left by a crash in the middle of a write,
+        ends the replay; so does a last line without its newline, which
+        the next Journal opened on the file cuts off.
+        """
+        if not path.exists(file_path):
+            return
+        with open(file_path, 'r') as f:
+            for line in f:
+                if not line.endswith('\n'):
+                    return
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    return
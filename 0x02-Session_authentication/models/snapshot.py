@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+""" Binary snapshot module
+
+A binary snapshot holds the same records as `.db_<Class>.json`:
+
+    header   magic, record count, index offset, size of the ID list
+    records  per record: payload size, created_at and updated_at as
+             epoch seconds, then the other fields as JSON
+    index    the record offsets, then the IDs joined by newlines
+
+Reading it through mmap only parses the index; a record is decoded when
+it is looked up.
+"""
+from array import array
+from collections.abc import MutableMapping
+from datetime import datetime, timedelta
+from typing import Iterable, Iterator, Tuple
+import json
+import mmap
+import os
+import struct
+import sys
+
+
+MAGIC = b'BASESNP1'
+HEADER = struct.Struct('<8sQQQ')
+RECORD = struct.Struct('<Iqq')
+EPOCH = datetime(1970, 1, 1)
+SECOND = timedelta(seconds=1)
+NO_TIME = -1 << 63
+
+
+def _to_epoch(value) -> int:
+    """ Return a datetime or ISO 8601 string as epoch seconds
+    """
+    if value is None:
+        return NO_TIME
+    if not isinstance(value, datetime):
+        value = datetime.fromisoformat(value)
+    return (value - EPOCH) // SECOND
+
+
+def _offsets_bytes(offsets: array) -> bytes:
+    """ Return the offsets as little-endian bytes
+    """
+    if sys.byteorder == 'big':
+        offsets = array('Q', offsets)
+        offsets.byteswap()
+    return offsets.tobytes()
+
+
+def encode_record(record: dict) -> bytes:
+    """ Encode a record, whose timestamps are datetimes or strings
+    """
+    fields = dict(record)
+    created_at = _to_epoch(fields.pop('created_at', None))
+    updated_at = _to_epoch(fields.pop('updated_at', None))
+    payload = json.dumps(fields).encode()
+    return RECORD.pack(len(payload), created_at, updated_at) + payload
+
+
+def decode_record(buf, offset: int) -> dict:
+    """ Decode the record at offset, with its timestamps as datetimes
+    """
+    size, created_at, updated_at = RECORD.unpack_from(buf, offset)
+    start = offset + RECORD.size
+    record = json.loads(buf[start:start + size].decode())
+    if created_at != NO_TIME:
+        record['created_at'] = EPOCH + timedelta(seconds=created_at)
+    if updated_at != NO_TIME:
+        record['updated_at'] = EPOCH + timedelta(seconds=updated_at)
+    return record
+
+
+def write_snapshot(file_path: str, items: Iterable[Tuple[str, dict]]):
+    """ Write (id, record) pairs to a temporary file renamed over file_path
+    """
+    tmp_path = "{}.tmp".format(file_path)
+    ids = []
+    offsets = array('Q')
+    with open(tmp_path, 'wb') as f:
+        f.write(b'\0' * HEADER.size)
+        offset = HEADER.size
+        for obj_id, record in items:
+            if '\n' in obj_id:
+                raise ValueError("IDs cannot contain newlines")
+            data = encode_record(record)
+            f.write(data)
+            ids.append(obj_id)
+            offsets.append(offset)
+            offset += len(data)
+        ids_bytes = '\n'.join(ids).encode()
+        f.write(_offsets_bytes(offsets))
+        f.write(ids_bytes)
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, len(ids), offset, len(ids_bytes)))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, file_path)
+
+
+class BinarySnapshot(MutableMapping):
+    """ Mapping of ID to record over a memory-mapped binary snapshot
+
+    Opening it parses the index only. Records are decoded on lookup;
+    records set afterwards, e.g. when replaying a journal, are kept as
+    given and keep the position of the ID they replace.
+    """
+
+    def __init__(self, file_path: str):
+        """ Map file_path and read its index
+        """
+        with open(file_path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count, index_offset, ids_size = HEADER.unpack_from(
+            self._mmap)
+        if magic != MAGIC:
+            raise ValueError("{} is not a binary snapshot".format(file_path))
+        ids_offset = index_offset + 8 * count
+        offsets = array('Q')
+        offsets.frombytes(self._mmap[index_offset:ids_offset])
+        if sys.byteorder == 'big':
+            offsets.byteswap()
+        ids = self._mmap[ids_offset:ids_offset + ids_size].decode()
+        self._records = dict(zip(ids.split('\n') if count else (),
+                                 offsets))
+
+    def __getitem__(self, obj_id: str) -> dict:
+        """ Return the record of an ID, decoding it if needed
+        """
+        record = self._records[obj_id]
+        if isinstance(record, int):
+            return decode_record(self._mmap, record)
+        return record
+
+    def __setitem__(self, obj_id: str, record: dict):
+        """ Set the record of an ID
+        """
+        self._records[obj_id] = record
+
+    def __delitem__(self, obj_id: str):
+        """ Forget the record of an ID
+        """
+        del self._records[obj_id]
+
+    def __contains__(self, obj_id) -> bool:
+        """ Tell whether an ID has a record, without decoding it
+        """
+        return obj_id in self._records
+
+    def __iter__(self) -> Iterator[str]:
+        """ Iterate over the IDs in file order
+        """
+        return iter(self._records)
+
+    def __len__(self) -> int:
+        """ Return the number of records
+        """
+        return len(self._records)
+
+
+def json_to_binary(json_path: str, binary_path: str):
+    """ Convert a `.db_<Class>.json` file to a binary snapshot
+    """
+    from models.base import iter_json_items
+    with open(json_path, 'r') as f:
+        write_snapshot(binary_path, iter_json_items(f))
+
+
+def binary_to_json(binary_path: str, json_path: str,
+                   timestamp_format: str = "%Y-%m-%dT%H:%M:%S"):
+    """ Convert a binary snapshot to a `.db_<Class>.json` file
+    """
+    snapshot = BinarySnapshot(binary_path)
+    objs_json = {}
+    for obj_id in snapshot:
+        record = snapshot[obj_id]
+        for key in ('created_at', 'updated_at'):
+            if key in record:
+                record[key] = record[key].strftime(timestamp_format)
+        objs_json[obj_id] = record
+    tmp_path = "{}.tmp".format(json_path)
+    with open(tmp_path, 'w') as f:
+        json.dump(objs_json, f)
+    os.replace(tmp_path, json_path)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        sys.exit("Usage: python3 -m models.snapshot SOURCE DEST\n"
+                 "Converts between .json and .bin snapshots, "
+                 "by file extension")
+    source, dest = sys.argv[1:]
+    if source.endswith('.json'):
+        json_to_binary(source, dest)
+    else:
+        binary_to_json(source, dest)
@@ -8,6 +8,10 @@ from models.base import Base
 class User(Base):
     """ User class
     """
+    __slots__ = ('email', '_password', 'first_name', 'last_name')
+    __indexes__ = ('email',)
+    __sorted_indexes__ = ('email', 'created_at')
+    __interned__ = ('first_name', 'last_name')
 
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a User instance
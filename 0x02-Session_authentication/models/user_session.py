@@ -8,6 +8,8 @@ from models.base import Base
 
 class UserSession(Base):
     """UserSession model for managing user sessions."""
+    __slots__ = ('user_id', 'session_id', 'expiry_time')
+    __interned__ = ('user_id',)
 
     def __init__(self, *args: list, **kwargs: dict):
         """Initialize a UserSession instance."""
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+""" Tests of the journal storage mode
+"""
+import os
+import tempfile
+import unittest
+import models.base as base
+from models.journal import Journal
+from models.user import User
+
+
+class TestTornTail(unittest.TestCase):
+    """ A record torn by a crash does not swallow later records
+    """
+
+    def setUp(self):
+        """ Work in a temporary directory, in journal mode
+        """
+        self.cwd = os.getcwd()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp_dir.name)
+        self.storage = base.STORAGE
+        base.STORAGE = 'journal'
+
+    def tearDown(self):
+        """ Close the journals and restore the working directory
+        """
+        self.restart()
+        base.STORAGE = self.storage
+        os.chdir(self.cwd)
+        self.tmp_dir.cleanup()
+
+    def restart(self):
+        """ Drop the open journals, as a process restart would
+        """
+        for journal in base.JOURNALS.values():
+            journal.close()
+        base.JOURNALS.clear()
+
+    def test_journal_truncates_torn_tail(self):
+        """ Opening a journal cuts off the torn record before appending
+        """
+        journal = Journal('test.journal')
+        journal.append_many([{'n': 1}, {'n': 2}])
+        journal.close()
+        with open('test.journal', 'a') as f:
+            f.write('{"n": 3')
+        journal = Journal('test.journal')
+        journal.append({'n': 4})
+        journal.close()
+        self.assertEqual([record['n'] for record in
+                          Journal.replay('test.journal')], [1, 2, 4])
+
+    def test_replay_skips_unterminated_record(self):
+        """ A last record without its newline is not replayed
+        """
+        with open('test.journal', 'w') as f:
+            f.write('{"n": 1}\n{"n": 2}')
+        self.assertEqual(list(Journal.replay('test.journal')), [{'n': 1}])
+
+    def test_save_after_torn_tail_survives_reload(self):
+        """ A user saved after a crash is still there after a reload
+        """
+        User.load_from_file()
+        for i in range(3):
+            user = User()
+            user.email = "user{}@example.com".format(i)
+            user.save()
+        self.restart()
+        with open('.db_User.journal', 'a') as f:
+            f.write('{"op": "save", "id": "torn", "da')
+
+        User.load_from_file()
+        user = User()
+        user.email = "after@example.com"
+        user.save()
+        self.assertEqual(User.count(), 4)
+        self.restart()
+
+        User.load_from_file()
+        self.assertEqual(User.count(), 4)
+        self.assertEqual(len(User.search({'email': "after@example.com"})), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
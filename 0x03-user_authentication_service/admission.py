@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""Admission control module"""
+
+from threading import Condition
+import time
+
+
+class Overloaded(Exception):
+    """Raised when a request is shed instead of queued."""
+
+    def __init__(self, retry_after: float):
+        super().__init__("Service overloaded")
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Bounded in-flight limit with a waiting queue and a per-request
+    deadline.
+
+    A request runs at once if a slot is free; otherwise it waits in the
+    queue. It is shed when the queue is full, when the estimated wait
+    (from a moving average of service times) exceeds the deadline, or
+    when the deadline passes while it waits.
+    """
+
+    SMOOTHING = 0.2
+
+    def __init__(self, max_in_flight: int, max_queue: int,
+                 deadline: float):
+        """
+        Args:
+            max_in_flight (int): Requests allowed to run at once.
+            max_queue (int): Requests allowed to wait for a slot.
+            deadline (float): Longest wait for a slot, in seconds.
+        """
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.deadline = deadline
+        self._cond = Condition()
+        self.in_flight = 0
+        self.waiting = 0
+        self.service_time = 0.0
+        self.admitted = 0
+        self.shed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def estimated_wait(self) -> float:
+        """
+        Returns:
+            float: Expected wait of a new request, in seconds.
+        """
+        if self.in_flight < self.max_in_flight:
+            return 0.0
+        rounds = self.waiting // self.max_in_flight + 1
+        return rounds * self.service_time
+
+    def acquire(self) -> None:
+        """
+        Takes a slot, waiting for one up to the deadline.
+
+        Raises:
+            Overloaded: If the request is shed.
+        """
+        with self._cond:
+            if self.in_flight < self.max_in_flight and not self.waiting:
+                self.in_flight += 1
+                self.admitted += 1
+                return
+            estimate = self.estimated_wait()
+            if self.waiting >= self.max_queue or estimate > self.deadline:
+                self.shed += 1
+                raise Overloaded(max(estimate, 1.0))
+            start = time.monotonic()
+            self.waiting += 1
+            try:
+                while self.in_flight >= self.max_in_flight:
+                    remaining = start + self.deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.shed += 1
+                        raise Overloaded(max(self.estimated_wait(), 1.0))
+                    self._cond.wait(remaining)
+            finally:
+                self.waiting -= 1
+            waited = time.monotonic() - start
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+            self.in_flight += 1
+            self.admitted += 1
+
+    def release(self, service_time: float) -> None:
+        """
+        Frees a slot and folds the request duration into the average.
+
+        Args:
+            service_time (float): How long the request ran, in seconds.
+        """
+        with self._cond:
+            self.in_flight -= 1
+            if self.service_time:
+                self.service_time += self.SMOOTHING * (
+                    service_time - self.service_time)
+            else:
+                self.service_time = service_time
+            self._cond.notify()
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict: Queue length, shed count and wait time figures.
+        """
+        with self._cond:
+            return {
+                "in_flight": self.in_flight,
+                "queue_length": self.waiting,
+                "admitted": self.admitted,
+                "shed": self.shed,
+                "avg_wait_ms": (1000 * self.total_wait / self.admitted
+                                if self.admitted else 0.0),
+                "max_wait_ms": 1000 * self.max_wait,
+                "avg_service_ms": 1000 * self.service_time,
+            }
@@ -3,11 +3,63 @@
 """
 from flask import Flask, jsonify, abort
 from flask import request
+from functools import wraps
+from math import ceil
+from os import cpu_count, getenv
+import time
+from admission import AdmissionController, Overloaded
 from auth import Auth
+from hash_executor import get_executor
+from throttle import Throttle
 
 app = Flask(__name__)
 # Creating an instance of the Auth class
 AUTH = Auth()
+# Login attempts allowed per email and per client IP, checked before
+# any bcrypt work
+LOGIN_THROTTLE = Throttle({
+    "email": (float(getenv("LOGIN_EMAIL_PER_MINUTE", "10")) / 60,
+              float(getenv("LOGIN_EMAIL_BURST", "10"))),
+    "ip": (float(getenv("LOGIN_IP_PER_MINUTE", "60")) / 60,
+           float(getenv("LOGIN_IP_BURST", "60"))),
+}, int(getenv("LOGIN_THROTTLE_KEYS", "100000")))
+# Bounds the bcrypt-heavy endpoints: requests beyond the in-flight limit
+# wait in a bounded queue and are shed once they can't meet the deadline
+ADMISSION = AdmissionController(
+    int(getenv("ADMISSION_MAX_IN_FLIGHT", str(cpu_count() or 1))),
+    int(getenv("ADMISSION_MAX_QUEUE", "64")),
+    float(getenv("ADMISSION_DEADLINE", "2.0")),
+)
+
+
+def too_many_requests(retry_after: float):
+    """ Build a 429 response telling the client when to retry.
+    """
+    response = jsonify({"message": "too many requests"})
+    response.status_code = 429
+    response.headers["Retry-After"] = str(ceil(retry_after))
+    return response
+
+
+def admitted(view):
+    """ Run the view under admission control, answering 503 with
+        Retry-After when the request is shed.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        try:
+            ADMISSION.acquire()
+        except Overloaded as e:
+            response = jsonify({"message": "service overloaded"})
+            response.status_code = 503
+            response.headers["Retry-After"] = str(ceil(e.retry_after))
+            return response
+        start = time.monotonic()
+        try:
+            return view(*args, **kwargs)
+        finally:
+            ADMISSION.release(time.monotonic() - start)
+    return wrapper
 
 
 @app.route('/', methods=['GET'], strict_slashes=False)
@@ -22,6 +74,7 @@ def home():
 
 
 @app.route('/users', methods=['POST'], strict_slashes=False)
+@admitted
 def create_user():
     """ Register a new user.
         Expects form data with 'email' and 'password' fields.
@@ -58,6 +111,20 @@ def log_in():
         # If email or password is not provided, return a 400 error
         abort(400)
 
+    retry_after = LOGIN_THROTTLE.acquire(email=email, ip=request.remote_addr)
+    if retry_after:
+        # Reject throttled attempts before paying for bcrypt, and before
+        # they take an admission slot or a place in its queue
+        return too_many_requests(retry_after)
+
+    return open_session(email, password)
+
+
+@admitted
+def open_session(email: str, password: str):
+    """ Check the credentials of a login under admission control.
+        Returns a JSON response with the session ID as a cookie.
+    """
     if not AUTH.valid_login(email, password):
         # If the login credentials are invalid, return a 401 error
         abort(401)
@@ -136,6 +203,7 @@ def get_reset_password_token():
 
 
 @app.route('/reset_password', methods=['PUT'], strict_slashes=False)
+@admitted
 def update_password():
     """ Update the user's password.
         Expects form data with 'email', 'reset_token', and
@@ -159,5 +227,17 @@ def update_password():
         abort(403)
 
 
+@app.route('/metrics', methods=['GET'], strict_slashes=False)
+def metrics():
+    """ Report the login throttle, admission control and password
+        hashing counters.
+    """
+    return jsonify({
+        "throttle": LOGIN_THROTTLE.stats(),
+        "admission": ADMISSION.stats(),
+        "hashing": get_executor().stats(),
+    })
+
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port="5000")
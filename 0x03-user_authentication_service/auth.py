@@ -1,8 +1,8 @@
 #!/usr/bin/env python3
 """Authentication management module"""
 
-import bcrypt
 from db import DB
+from hash_executor import get_executor, needs_rehash
 from sqlalchemy.orm.exc import NoResultFound
 from typing import Union
 from user import User
@@ -10,8 +10,9 @@ from uuid import uuid4
 
 
 def _hash_password(password: str) -> bytes:
-    """Hashes a password and returns the hashed bytes."""
-    return bcrypt.hashpw(password.encode(), bcrypt.gensalt())
+    """Hashes a password on the shared bcrypt pool and returns the
+    hashed bytes."""
+    return get_executor().hash_password(password)
 
 
 def _generate_uuid() -> str:
@@ -53,6 +54,9 @@ class Auth:
         """
         Validates the user's login credentials.
 
+        When the stored hash was made with a lower bcrypt cost factor
+        than the configured one, the password is rehashed and saved.
+
         Args:
             email (str): The user's email address.
             password (str): The user's password.
@@ -65,9 +69,13 @@ class Auth:
         except NoResultFound:
             return False
 
-        if bcrypt.checkpw(password.encode(), user.hashed_password.encode()):
-            return True
-        return False
+        hashed_password = user.hashed_password.encode()
+        if not get_executor().check_password(password, hashed_password):
+            return False
+        if needs_rehash(hashed_password):
+            rehashed = _hash_password(password).decode('utf-8')
+            self._db.update_user(user.id, hashed_password=rehashed)
+        return True
 
     def create_session(self, email: str) -> Union[str, None]:
         """
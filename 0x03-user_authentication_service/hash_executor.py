@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+hash_executor module
+
+This module runs bcrypt hashing and checking on a shared, sized pool so
+that callers wait on a future instead of burning their own thread. It
+also calibrates the bcrypt cost factor to the host and keeps it in a
+small JSON config file.
+"""
+from concurrent.futures import (Executor, Future, ProcessPoolExecutor,
+                                ThreadPoolExecutor)
+from datetime import datetime
+from os import environ
+import asyncio
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+
+import bcrypt
+
+DEFAULT_ROUNDS = 12
+MIN_ROUNDS = 4
+MAX_ROUNDS = 20
+LATENCY_BUDGET_MS = 50.0
+CONFIG_PATH = ".bcrypt.json"
+_executor = None
+_executor_lock = threading.Lock()
+_rounds = None
+
+
+def config_path() -> str:
+    """Returns the path of the bcrypt config file (BCRYPT_CONFIG)"""
+    return environ.get("BCRYPT_CONFIG", CONFIG_PATH)
+
+
+def calibrate_rounds(budget_ms: float = LATENCY_BUDGET_MS,
+                     samples: int = 3) -> int:
+    """
+    Benchmarks this host and picks the highest bcrypt cost factor whose
+    hashing time stays within the latency budget.
+
+    Each extra round doubles the cost, so the search stops as soon as
+    the next factor is expected to exceed the budget.
+
+    Args:
+        budget_ms: The latency budget of one hash, in milliseconds.
+        samples: How many hashes are timed per cost factor.
+
+    Returns:
+        int: The chosen cost factor, at least MIN_ROUNDS.
+    """
+    chosen = MIN_ROUNDS
+    for rounds in range(MIN_ROUNDS, MAX_ROUNDS + 1):
+        salt = bcrypt.gensalt(rounds)
+        timings = []
+        for _ in range(samples):
+            start = time.perf_counter()
+            bcrypt.hashpw(b"calibration", salt)
+            timings.append(1000 * (time.perf_counter() - start))
+        elapsed = statistics.median(timings)
+        if elapsed > budget_ms:
+            break
+        chosen = rounds
+        if 2 * elapsed > budget_ms:
+            break
+    return chosen
+
+
+def save_rounds(rounds: int, budget_ms: float = None):
+    """Stores the cost factor in the bcrypt config file"""
+    global _rounds
+    config = {"rounds": rounds, "budget_ms": budget_ms,
+              "calibrated_at": datetime.utcnow().isoformat()}
+    with open(config_path(), "w") as f:
+        json.dump(config, f)
+    _rounds = rounds
+
+
+def get_rounds() -> int:
+    """
+    Returns the bcrypt cost factor to hash new passwords with.
+
+    BCRYPT_ROUNDS wins over the config file, which wins over
+    DEFAULT_ROUNDS. The value is read once and then cached.
+    """
+    global _rounds
+    if _rounds is None:
+        rounds = environ.get("BCRYPT_ROUNDS")
+        if rounds is None and os.path.exists(config_path()):
+            with open(config_path()) as f:
+                rounds = json.load(f).get("rounds")
+        _rounds = int(rounds) if rounds else DEFAULT_ROUNDS
+    return _rounds
+
+
+def hash_rounds(hashed_password: bytes) -> int:
+    """Returns the cost factor a bcrypt hash was made with"""
+    return int(hashed_password.split(b"$")[2])
+
+
+def needs_rehash(hashed_password: bytes) -> bool:
+    """Returns True if the hash was made with a lower cost factor"""
+    return hash_rounds(hashed_password) < get_rounds()
+
+
+def _hash(password: bytes, rounds: int = None) -> bytes:
+    """Hashes a password with a new salt; runs on the pool"""
+    salt = bcrypt.gensalt() if rounds is None else bcrypt.gensalt(rounds)
+    return bcrypt.hashpw(password, salt)
+
+
+def _check(password: bytes, hashed_password: bytes) -> bool:
+    """Checks a password against its hash; runs on the pool"""
+    return bcrypt.checkpw(password, hashed_password)
+
+
+class HashExecutor:
+    """
+    Sized thread or process pool dedicated to bcrypt.
+
+    bcrypt releases the GIL, so a thread pool already spreads the work
+    across cores; a process pool is available for other setups.
+    """
+
+    def __init__(self, workers: int = None, kind: str = "thread"):
+        """
+        Args:
+            workers: Size of the pool, the number of CPUs by default.
+            kind: "thread" or "process".
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.kind = kind
+        if kind == "thread":
+            self._pool: Executor = ThreadPoolExecutor(
+                self.workers, thread_name_prefix="bcrypt")
+        elif kind == "process":
+            self._pool = ProcessPoolExecutor(self.workers)
+        else:
+            raise ValueError(f"Unknown executor kind {kind!r}")
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def submit(self, func, *args) -> Future:
+        """
+        Schedules func(*args) on the pool and records its latency.
+
+        Returns:
+            Future: The future of the call.
+        """
+        started = time.perf_counter()
+        with self._lock:
+            self.submitted += 1
+        future = self._pool.submit(func, *args)
+
+        def done(_):
+            latency = time.perf_counter() - started
+            with self._lock:
+                self.completed += 1
+                self.total_latency += latency
+                self.max_latency = max(self.max_latency, latency)
+
+        future.add_done_callback(done)
+        return future
+
+    def hash_password(self, password: str, rounds: int = None) -> bytes:
+        """
+        Hashes a password on the pool and waits for the result.
+
+        Args:
+            password: The password to hash.
+            rounds: The cost factor, get_rounds() by default.
+
+        Returns:
+            bytes: The salted, hashed password.
+        """
+        if rounds is None:
+            rounds = get_rounds()
+        return self.submit(_hash, password.encode(), rounds).result()
+
+    def check_password(self, password: str, hashed_password: bytes) -> bool:
+        """
+        Checks a password on the pool and waits for the result.
+
+        Returns:
+            bool: True if the password matches the hashed password.
+        """
+        return self.submit(_check, password.encode(),
+                           hashed_password).result()
+
+    async def hash_password_async(self, password: str,
+                                  rounds: int = None) -> bytes:
+        """Awaitable version of hash_password"""
+        if rounds is None:
+            rounds = get_rounds()
+        return await asyncio.wrap_future(
+            self.submit(_hash, password.encode(), rounds))
+
+    async def check_password_async(self, password: str,
+                                   hashed_password: bytes) -> bool:
+        """Awaitable version of check_password"""
+        return await asyncio.wrap_future(
+            self.submit(_check, password.encode(), hashed_password))
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict: Queue depth and latency figures of the pool.
+        """
+        with self._lock:
+            in_flight = self.submitted - self.completed
+            return {
+                "kind": self.kind,
+                "workers": self.workers,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "in_flight": in_flight,
+                "queued": max(0, in_flight - self.workers),
+                "avg_latency_ms": (1000 * self.total_latency /
+                                   self.completed if self.completed
+                                   else 0.0),
+                "max_latency_ms": 1000 * self.max_latency,
+            }
+
+    def shutdown(self, wait: bool = True):
+        """Stops the pool once the pending calls are done"""
+        self._pool.shutdown(wait)
+
+
+def get_executor() -> HashExecutor:
+    """
+    Returns the shared HashExecutor, created on first use.
+
+    Its size comes from BCRYPT_WORKERS and its kind ("thread" or
+    "process") from BCRYPT_EXECUTOR.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            workers = environ.get("BCRYPT_WORKERS")
+            _executor = HashExecutor(
+                int(workers) if workers else None,
+                environ.get("BCRYPT_EXECUTOR", "thread"))
+        return _executor
+
+
+async def hash_password_async(password: str, rounds: int = None) -> bytes:
+    """Hashes a password on the shared pool without blocking the loop"""
+    return await get_executor().hash_password_async(password, rounds)
+
+
+async def check_password_async(password: str,
+                               hashed_password: bytes) -> bool:
+    """Checks a password on the shared pool without blocking the loop"""
+    return await get_executor().check_password_async(password,
+                                                     hashed_password)
+
+
+if __name__ == "__main__":
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else LATENCY_BUDGET_MS
+    chosen = calibrate_rounds(budget)
+    save_rounds(chosen, budget)
+    print(f"bcrypt cost factor {chosen} for a {budget:g} ms budget, "
+          f"saved to {config_path()}")
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""Login throttling module"""
+
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, Tuple
+import time
+
+
+class Throttle:
+    """
+    Token-bucket throttle keyed by (kind, value), e.g. ("email", ...)
+    and ("ip", ...).
+
+    Each kind has its own refill rate and burst size. Buckets are
+    refilled lazily on access, so every check is O(1), and the table
+    keeps at most `max_keys` buckets, evicting the least recently used.
+    """
+
+    def __init__(self, limits: Dict[str, Tuple[float, float]],
+                 max_keys: int = 100000):
+        """
+        Args:
+            limits (dict): Maps each kind to (tokens per second, burst).
+            max_keys (int): Maximum number of buckets kept.
+        """
+        self.limits = dict(limits)
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = Lock()
+        self.allowed = 0
+        self.rejected = {kind: 0 for kind in self.limits}
+        self.evicted = 0
+
+    def _bucket(self, key: Tuple[str, str], now: float) -> list:
+        """Returns the refilled [tokens, updated_at] bucket of a key"""
+        rate, burst = self.limits[key[0]]
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = [burst, now]
+            self._buckets[key] = bucket
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+                self.evicted += 1
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+        return bucket
+
+    def acquire(self, **values: str) -> float:
+        """
+        Takes one token from the bucket of every given kind, or none
+        if any of them is empty.
+
+        Args:
+            **values: The value of each kind, e.g. email=..., ip=...
+
+        Returns:
+            float: 0 if the attempt is allowed, otherwise the number of
+                   seconds until it would be.
+        """
+        now = time.monotonic()
+        with self._lock:
+            buckets = {kind: self._bucket((kind, value), now)
+                       for kind, value in values.items()
+                       if value is not None}
+            wait = 0.0
+            for kind, bucket in buckets.items():
+                if bucket[0] < 1:
+                    rate = self.limits[kind][0]
+                    wait = max(wait, (1 - bucket[0]) / rate)
+                    self.rejected[kind] += 1
+            if wait:
+                return wait
+            for bucket in buckets.values():
+                bucket[0] -= 1
+            self.allowed += 1
+            return 0.0
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict: The throttle counters.
+        """
+        with self._lock:
+            return {
+                "allowed": self.allowed,
+                "rejected": dict(self.rejected),
+                "evicted": self.evicted,
+                "keys": len(self._buckets),
+            }